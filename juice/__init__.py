@@ -4,10 +4,15 @@ from os import path
 from pathlib import Path
 import sys
 import getpass
+from ._psql import create_pool
+from ._duckdb import create_embedded_store
+from ._http import create_session
+from ._cache import RateCache
 from ._data import (
     OCTOPUS_SMART_TARIFF_PRODUCT_CODES,
     OCTOPUS_SMART_TARIFF_FAMILIES,
     AGILE_OCTOPUS,
+    RATE_CACHE_SIZE,
 )
 from datetime import datetime
 
@@ -25,6 +30,7 @@ class Juice:
     from ._get import (
         _get_octopus_products,
         _get_consumption,
+        _backfill_consumption,
         _get_tariffs,
         _get_calorific_values,
     )
@@ -47,15 +53,22 @@ class Juice:
         update_existing_products,
         update,
         update_products_database_by_product_code,
+        migrate_consumption_tables,
+        backfill_consumption,
+        import_consumption,
     )
 
     __all__ = [
+        "close",
         "update_by_product_code",
         "update_by_product_family",
         "update_by_tariff_code",
         "update_existing_products",
         "update",
         "update_products_database_by_product_code",
+        "migrate_consumption_tables",
+        "backfill_consumption",
+        "import_consumption",
         "remove_method",
         "add_bill",
         "add_method",
@@ -71,6 +84,11 @@ class Juice:
         LDZ: str | None = None,
         energy_type: str | None = None,
         headers: dict | None = None,
+        pool_config: dict | None = None,
+        partitioned_consumption: bool = False,
+        unified_rates: bool = False,
+        embedded: str | None = None,
+        http_config: dict | None = None,
     ) -> None:
         """
         Juice constructor prepares the account information to carry out calculations and comparisons.
@@ -85,6 +103,11 @@ class Juice:
             LDZ: A string with the account's gas local distribution zone id. It's only need for accounts with gas energy and when a LDZ database has not been configured.
             energy_type: An energy type to be set for succeeding methods to use.
             headers: A dictionary containing settings to be passed on to Python Requests library when making network requests.
+            pool_config: A dictionary containing settings for the PostgresQL connection pool, e.g. min_size, max_size, max_lifetime and max_idle.
+            partitioned_consumption: Whether to store consumption for all meters in a single table partitioned by month instead of one table per meter.
+            unified_rates: Whether to store the unit rates and standing charges of all tariffs in a single table keyed by tariff code instead of two tables per tariff.
+            embedded: A path to a DuckDB database file to use instead of a PostgresQL server, e.g. "utilities.duckdb" or ":memory:".
+            http_config: A dictionary containing settings for network requests, e.g. retries, backoff_factor, rate (requests per second), burst, page_size (up to 1500), page_workers, cache (a path to an on-disk response cache) and cache_size in bytes.
 
         Returns:
             Juice constructor
@@ -105,9 +128,29 @@ class Juice:
                 "autocommit": True,
             }
 
+        if embedded:
+            if partitioned_consumption or unified_rates:
+                raise ValueError(
+                    "partitioned_consumption and unified_rates are only available with a PostgresQL database."
+                )
+            self.psql_pool = create_embedded_store(embedded)
+        else:
+            self.psql_pool = create_pool(self.psql_config, pool_config)
+
+        self.embedded = embedded
+
+        self.headers = headers
+        self.session = create_session(headers, http_config)
+
+        self.partitioned_consumption = partitioned_consumption
+        self.unified_rates = unified_rates
+
+        # rates and joined rates are kept between calculations, see rate_cache.info() for its hits and misses
+        self.rate_cache = RateCache(RATE_CACHE_SIZE)
+
         self.API_KEY = API_KEY
         self.ACCOUNT_ID = ACCOUNT_ID.upper()
-        self.ACCOUNT_DATA = self._set_account_info()
+        self.ACCOUNT_DATA = self._set_account_info(LDZ)
         self.CONSUMPTION, self.AGREEMENTS, self.GSP, queried_ldz = (
             self._parse_account_information(self.ACCOUNT_DATA)
         )
@@ -133,8 +176,6 @@ class Juice:
 
         self._add_consumption()
 
-        self.headers = headers
-
         pass
 
     @property
@@ -185,6 +226,24 @@ class Juice:
             self.MOVED_IN_AT = self.GAS_EARLIEST
         pass
 
+    def close(self):
+        """
+        Close the PostgresQL connection pool or the embedded database and the network session used by the account.
+
+        Example:
+            >>> account.close()
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+
+        self.psql_pool.close()
+        self.session.close()
+        pass
+
     @staticmethod
     def _retrive_earliest(agreements, energy_type):
 
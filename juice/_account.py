@@ -10,10 +10,12 @@ from ._psql import query_ldz
 from ._data import OCOTPUS_API_BASE_URL
 
 
-def _set_account_info(self):
+def _set_account_info(self, LDZ=None):
     data = _read_account_json(self.ACCOUNT_ID)
     if not data:
-        data = _get_account_info(self.psql_config, self.API_KEY, self.ACCOUNT_ID)
+        data = _get_account_info(
+            self.psql_pool, self.API_KEY, self.ACCOUNT_ID, self.session, LDZ
+        )
 
     return data
 
@@ -38,10 +40,13 @@ def _read_account_json(ACCOUNT_ID):
 
 
 @staticmethod
-def _get_account_info(psql_config, API_KEY, ACCOUNT_ID):
+def _get_account_info(psql_config, API_KEY, ACCOUNT_ID, session=None, LDZ=None):
     ACCOUNT_URL = OCOTPUS_API_BASE_URL + f"/accounts/{ACCOUNT_ID}"
 
-    response = requests.get(ACCOUNT_URL, auth=HTTPBasicAuth(API_KEY, ""))
+    if session is None:
+        session = requests
+
+    response = session.get(ACCOUNT_URL, auth=HTTPBasicAuth(API_KEY, ""))
 
     data = response.json()
     if data == {"detail": "Not found."}:
@@ -49,9 +54,10 @@ def _get_account_info(psql_config, API_KEY, ACCOUNT_ID):
 
     data["updated"] = datetime.now()
 
+    # a given LDZ is used as it is, so no LDZ table is needed
     for property in data["properties"]:
         if property["gas_meter_points"]:
-            property["LDZ"] = query_ldz(
+            property["LDZ"] = LDZ or query_ldz(
                 psql_config, property["postcode"].replace(" ", "")
             )
 
@@ -1,18 +1,50 @@
-from datetime import datetime
+from datetime import datetime, timedelta
+from functools import partial
+import threading
 from prettytable import PrettyTable
 import math
 from pytz import timezone
 from psycopg import DatabaseError
-from ._psql import query_calorific_values, retrive_unit_rates, retrive_consumption
+from ._psql import (
+    query_calorific_values,
+    retrive_unit_rates,
+    retrive_consumption,
+    retrive_rounded_consumption,
+    retrive_tariff_rates,
+    retrive_daily_costs,
+    count_consumption,
+    summarise_consumption,
+    query_existing_tables,
+    create_daily_costs_db,
+    refresh_daily_costs,
+    query_latest_daily_cost,
+    query_earliest_stale_daily_cost,
+    retrive_rollup_costs,
+    query_updates,
+    query_all_updates,
+    insert_updates,
+    query_missing_rate_slices,
+    _to_datetime,
+)
+from ._database import _run_tasks, _create_shared_tables
 from ._utils import _parse_date, _format_date
+from ._intervals import interval_join
+from ._data import (
+    PARTITIONED_CONSUMPTION_TABLE,
+    DAILY_COSTS_TABLE,
+    GROUP_BY,
+    WINDOW_UPDATES_SUFFIX,
+    IMPORT_UPDATES_SUFFIX,
+)
 import pandas as pd
 import numpy as np
-import janitor
 
+ENGINES = {"pandas", "sql", "rollup"}
 
-def _get_consumption(psql_config, dbname, from_date, to_date):
 
-    s = retrive_consumption(psql_config, dbname, from_date, to_date)
+def _get_consumption(psql_config, dbname, from_date, to_date, meter=None):
+
+    s = retrive_consumption(psql_config, dbname, from_date, to_date, meter)
     if not s:
         return pd.DataFrame()
     r = pd.DataFrame(s, columns=["consumption", "from", "to"])
@@ -22,53 +54,200 @@ def _get_consumption(psql_config, dbname, from_date, to_date):
     return r.sort_values("from")
 
 
-def _join(psql_config, dbname, dataframe, from_date, to_date, LDZ=None):
+def _get_grouped_consumption(
+    psql_config, dbname, group_by, from_date, to_date, meter=None
+):
+    """
+    Return the group_by consumption totals of dbname with a rounded column holding the sum of their half hours each rounded as a half hour calculation rounds them. meter reads the half hours from the partitioned consumption table.
+    """
 
-    def get_unit_rates(dbname, from_date, to_date, payment_method="DIRECT_DEBIT"):
+    table_name = dbname + "_" + group_by
+    r = _get_consumption(psql_config, table_name, from_date, to_date)
+    if r.empty:
+        return r
 
-        if dbname == "calorific_values":
-            s = query_calorific_values(psql_config, dbname, LDZ, from_date, to_date)
-        else:
-            s = retrive_unit_rates(
-                psql_config, dbname, payment_method, from_date, to_date
+    s = retrive_rounded_consumption(
+        psql_config,
+        table_name,
+        PARTITIONED_CONSUMPTION_TABLE if meter else dbname,
+        from_date,
+        to_date,
+        meter,
+    )
+    rounded = pd.DataFrame(s, columns=["from", "rounded", "half_hours"])
+    rounded["from"] = pd.to_datetime(rounded["from"], utc=True).dt.tz_convert(None)
+    rounded["rounded"] = rounded["rounded"].astype(np.float64)
+
+    r = r.merge(rounded, on="from", how="left")
+
+    # a total is only used when every one of its half hours is stored
+    if not (r["half_hours"] * 1800 == (r["to"] - r["from"]).dt.total_seconds()).all():
+        raise ValueError
+
+    return r.drop(columns="half_hours")
+
+
+def _retrive_rates(
+    psql_config,
+    dbname,
+    from_date,
+    to_date,
+    LDZ=None,
+    unified_rates=False,
+    payment_method="DIRECT_DEBIT",
+):
+
+    if dbname == "calorific_values":
+        return query_calorific_values(psql_config, dbname, LDZ, from_date, to_date)
+
+    if unified_rates:
+        # dbname is the tariff code followed by the cost type, e.g. E-1R-AGILE-FLEX-22-11-25-C_standing_charges
+        tariff_code, cost_type = dbname.split("_", 1)
+        return [
+            row[1:]
+            for row in retrive_tariff_rates(
+                psql_config,
+                [tariff_code],
+                cost_type,
+                payment_method,
+                from_date,
+                to_date,
             )
+        ]
 
-        if not s or len(s) == 0:
-            raise ValueError
+    return retrive_unit_rates(psql_config, dbname, payment_method, from_date, to_date)
 
-        u = pd.DataFrame(s, columns=["rate", "valid_from", "valid_to"])
 
-        u["rate"] = u["rate"].astype(np.float64)
+def _updated(updates, name):
+    # a source changes when it is refreshed, when a window of it is downloaded and when it is imported from a file
+    return tuple(
+        updates.get(name + suffix)
+        for suffix in ["", WINDOW_UPDATES_SUFFIX, IMPORT_UPDATES_SUFFIX]
+    )
 
-        with pd.option_context("future.no_silent_downcasting", True):
-            u = u.fillna(pd.Timestamp.utcnow()).infer_objects(copy=False)
 
-        u["valid_from"] = u["valid_from"].dt.tz_convert(None)
-        u["valid_to"] = u["valid_to"].dt.tz_convert(None)
+def _source_updated(dbname, LDZ=None, updates=None):
+    # calorific values are marked as updated per LDZ and rates under their table name
+    if updates is None:
+        return None
+    if dbname == "calorific_values":
+        return _updated(updates, dbname + "_" + LDZ)
+    return _updated(updates, dbname)
+
+
+def _rate_frame(
+    psql_config,
+    dbname,
+    from_date,
+    to_date,
+    LDZ=None,
+    unified_rates=False,
+    payment_method="DIRECT_DEBIT",
+    rate_cache=None,
+    updates=None,
+):
+    """
+    Return the rates of dbname valid between from_date and to_date, or from from_date onwards when to_date is None, with the dates in UTC without a timezone. The valid_to of a current rate is left empty.
 
-        return u
+    With a rate_cache, the rates are only read from the database when they are not cached or dbname was updated since.
+    """
 
-    rates = get_unit_rates(
+    from_date = _to_datetime(from_date)
+    to_date = _to_datetime(to_date)
+
+    key = ("rates", dbname, LDZ, unified_rates, payment_method, from_date, to_date)
+    updated = _source_updated(dbname, LDZ, updates)
+
+    if rate_cache is not None:
+        u = rate_cache.get(key, updated)
+        if u is not None:
+            return u
+
+    s = _retrive_rates(
+        psql_config,
         dbname,
         from_date,
-        to_date,
+        # current rates are read up to a date well after any consumption
+        to_date or timezone("UTC").localize(datetime(3000, 1, 1)),
+        LDZ,
+        unified_rates,
+        payment_method,
     )
 
-    from_date = pd.to_datetime(from_date).to_datetime64()
-    to_date = pd.to_datetime(to_date).to_datetime64()
+    if not s or len(s) == 0:
+        raise ValueError
+
+    u = pd.DataFrame(s, columns=["rate", "valid_from", "valid_to"])
+
+    u["rate"] = u["rate"].astype(np.float64)
+    u["valid_from"] = pd.to_datetime(u["valid_from"], utc=True).dt.tz_convert(None)
+    u["valid_to"] = pd.to_datetime(u["valid_to"], utc=True).dt.tz_convert(None)
+
+    if rate_cache is not None:
+        rate_cache.set(key, updated, u)
+
+    return u
+
+
+def _join(
+    psql_config,
+    dbname,
+    dataframe,
+    from_date,
+    to_date,
+    LDZ=None,
+    unified_rates=False,
+    rate_cache=None,
+    updates=None,
+    consumption_key=None,
+):
+    """
+    Join the rates of dbname onto the rows of dataframe starting between from_date and to_date. A to_date of None leaves the rows unbounded.
+
+    consumption_key is a pair of a key identifying dataframe and the update times of its sources. With it and a rate_cache, the joined rows are reused until the rates or the consumption change.
+    """
 
-    joined = rates.conditional_join(
-        dataframe,
-        ("valid_to", "from", ">"),
-        ("valid_from", "to", "<"),
-        df_columns="rate",
+    if rate_cache is not None and consumption_key is not None:
+        key = ("joined", dbname, LDZ, unified_rates, from_date, to_date)
+        key += (consumption_key[0],)
+        updated = (_source_updated(dbname, LDZ, updates), consumption_key[1])
+
+        joined = rate_cache.get(key, updated)
+        if joined is None:
+            joined = _join(
+                psql_config,
+                dbname,
+                dataframe,
+                from_date,
+                to_date,
+                LDZ,
+                unified_rates,
+                rate_cache,
+                updates,
+            )
+            rate_cache.set(key, updated, joined)
+
+        return joined
+
+    rates = _rate_frame(
+        psql_config,
+        dbname,
+        from_date,
+        to_date,
+        LDZ,
+        unified_rates,
+        rate_cache=rate_cache,
+        updates=updates,
     )
 
-    filtered_by_dates = joined.loc[
-        (joined["from"] >= from_date) & (joined["from"] < to_date)
-    ]
+    joined = interval_join(rates, dataframe)
 
-    return filtered_by_dates
+    from_date = pd.to_datetime(from_date).to_datetime64()
+    in_dates = joined["from"] >= from_date
+    if to_date:
+        in_dates &= joined["from"] < pd.to_datetime(to_date).to_datetime64()
+
+    return joined.loc[in_dates]
 
 
 def _join_custom(rate, dataframe, from_date, to_date):
@@ -107,12 +286,7 @@ def _join_custom(rate, dataframe, from_date, to_date):
     from_date = pd.to_datetime(from_date).to_datetime64()
     to_date = pd.to_datetime(to_date).to_datetime64()
 
-    joined = rates.conditional_join(
-        dataframe,
-        ("valid_to", "from", ">"),
-        ("valid_from", "to", "<"),
-        df_columns="rate",
-    )
+    joined = interval_join(rates, dataframe)
 
     filtered_by_dates = joined.loc[
         (joined["from"] >= from_date) & (joined["from"] < to_date)
@@ -121,122 +295,139 @@ def _join_custom(rate, dataframe, from_date, to_date):
     return filtered_by_dates
 
 
-def _merge_dataframes(methods):
-
-    result = methods.copy()
-
-    methods_del = []
-    for index, method in enumerate(result["methods"]):
-
-        data = method["cost_types"]
+def _align(axis, rates):
+    """
+    Return the rates of a joined frame as a vector aligned to the from dates of axis, with NaN where there is no rate.
+    """
 
-        try:
-            ur = data["_standard_unit_rates"]
-            sc = data["_standing_charges"]
-            df = pd.merge(ur, sc[["rate", "from"]], on="from")
-            new_column_names = {
-                "rate_x": method["name"] + "_unit_rate",
-                "rate_y": method["name"] + "_standing_charge",
-            }
-
-            df.rename(columns=new_column_names, inplace=True)
-        except KeyError as e:
-            if e.args[0] == "_standard_unit_rates":
-                df = data["_standing_charges"]
-                new_column_names = {"rate": method["name"] + "_standing_charge"}
-                df.rename(columns=new_column_names, inplace=True)
-            elif e.args[0] == "_standing_charges":
-                df = ur
-                new_column_names = {"rate": method["name"] + "_unit_rate"}
-                df.rename(columns=new_column_names, inplace=True)
-
-        except (ValueError, TypeError):
-            methods_del.append(method)
-            continue
+    dates = rates["from"].to_numpy()
+    if len(dates) == len(axis) and (dates == axis).all():
+        # the joined frame usually already covers every period in order
+        return rates["rate"].to_numpy()
 
-        try:
-            cv = result["_calorific_values"]
+    vector = np.full(len(axis), np.nan)
+    vector[np.searchsorted(axis, dates)] = rates["rate"].to_numpy()
+    return vector
 
-            df = pd.merge(
-                df,
-                cv[["rate", "from"]],
-                on="from",
-            )
-            df.rename(columns={"rate": "calorific_values"}, inplace=True)
-        except KeyError:
-            pass
 
-        method["dataframe"] = df
+def _rate_matrix(axis, methods, cost_type):
+    """
+    Return a periods × methods array of the methods' rates for cost_type aligned to axis.
+    """
 
-    for index in methods_del:
-        result["methods"].remove(index)
+    # column major so every method's rates are contiguous
+    matrix = np.full((len(axis), len(methods)), np.nan, order="F")
+    for column, method in enumerate(methods):
+        if cost_type in method["cost_types"]:
+            matrix[:, column] = _align(axis, method["cost_types"][cost_type])
+    return matrix
 
-    return result
 
+def _calc_costs(data, energy_type, consumption_frames):
+    """
+    Cost every method at once. The methods sharing a consumption frame have their rates laid out side by side on its time axis so the costs and totals of all of them come from a few array operations.
+    """
 
-def _calc_costs(dataframes, energy_type):
-    data_in = _merge_dataframes(dataframes)
-    result = data_in.copy()
+    result = data.copy()
 
-    for method in result["methods"]:
+    # methods missing the rates of one of their cost types are left out
+    for method in list(result["methods"]):
+        if not all(
+            isinstance(rates, pd.DataFrame) for rates in method["cost_types"].values()
+        ):
+            result["methods"].remove(method)
 
-        data = method["dataframe"]
+    for group_by, consumption_df in consumption_frames.items():
+        methods = [
+            method for method in result["methods"] if method.get("group_by") == group_by
+        ]
+        if not methods:
+            continue
 
-        rate_unit = method["name"] + "_unit_rate"
-        rate_standing_charge = method["name"] + "_standing_charge"
-        cost_unit_rate = method["name"] + "_cost_unit_rate"
-        cost_standing_charge = method["name"] + "_cost_standing_charge"
-        total = method["name"] + "_total"
+        base = consumption_df[["from", "to", "consumption"]].reset_index(drop=True)
+        axis = base["from"].to_numpy()
+        consumption = base["consumption"].to_numpy()
 
-        a = pd.DataFrame(data[["from", "to", "consumption"]])
+        # totals are rounded as the sum of their rounded half hours, so they cost the same as the half hours
+        if group_by:
+            rounded = consumption_df["rounded"].to_numpy()
+        else:
+            rounded = base["consumption"].round(2).to_numpy()
 
         if energy_type == "gas":
-            a["calorific_value"] = data["calorific_values"]
-            a["consumption_units"] = a["consumption"].round(2)
-            a["consumption_rounded"] = (
-                a["consumption"] * np.float64(1.02264) * a["calorific_value"]
+            calorific_value = _align(axis, data[_calorific_key(group_by)])
+            base["calorific_value"] = calorific_value
+            base["consumption_units"] = rounded
+            base["consumption_rounded"] = (
+                consumption * np.float64(1.02264) * calorific_value
             ) / np.float64(3.6)
-
         else:
-            a["consumption_rounded"] = a["consumption"].round(2)
+            base["consumption_rounded"] = rounded
 
-        #
-        try:
-            a[cost_unit_rate] = data[rate_unit] * a["consumption_rounded"]
-        except KeyError:
-            pass
+        days = (base["to"] - base["from"]).dt.total_seconds().to_numpy() / 86400
 
-        try:
-            a[cost_standing_charge] = data[rate_standing_charge] * (
-                (a["to"] - a["from"]).dt.seconds / 86400
-            )
+        has_unit_rates = np.array(
+            ["_standard_unit_rates" in method["cost_types"] for method in methods]
+        )
+        has_standing_charges = np.array(
+            ["_standing_charges" in method["cost_types"] for method in methods]
+        )
 
-        except KeyError:
-            pass
+        unit_rate_costs = (
+            _rate_matrix(axis, methods, "_standard_unit_rates")
+            * base["consumption_rounded"].to_numpy()[:, None]
+        )
+        standing_charge_costs = (
+            _rate_matrix(axis, methods, "_standing_charges") * days[:, None]
+        )
+        totals = np.where(has_unit_rates, unit_rate_costs, 0) + np.where(
+            has_standing_charges, standing_charge_costs, 0
+        )
 
-        try:
-            a[total] = a[cost_unit_rate] + a[cost_standing_charge]
-        except KeyError:
-            try:
-                a[total] = a[cost_unit_rate]
-            except KeyError:
-                a[total] = a[cost_standing_charge]
+        for column, method in enumerate(methods):
+            name = method["name"]
+            costs = {}
+            if has_unit_rates[column]:
+                costs[name + "_cost_unit_rate"] = unit_rate_costs[:, column]
+            if has_standing_charges[column]:
+                costs[name + "_cost_standing_charge"] = standing_charge_costs[:, column]
+            costs[name + "_total"] = totals[:, column]
 
-        method["dataframe"] = a
+            method["dataframe"] = base.assign(**costs)
 
     return result
 
 
 @staticmethod
-def _run_config(psql_config, data, energy_type, from_date, to_date, LDZ=None):
+def _run_config(
+    psql_config,
+    data,
+    energy_type,
+    from_date,
+    to_date,
+    LDZ=None,
+    partitioned_consumption=False,
+    unified_rates=False,
+    rate_cache=None,
+    updates=None,
+    workers=None,
+    group_by=None,
+):
+    """
+    Calculate the methods from half hours or, with group_by, from the daily ("day") or hourly ("hour") consumption totals for each method whose agreements and rates do not change within them. "day" also allows hourly totals for methods whose rates change within a day.
+    """
 
-    def min_max_dates_and_size_check(data, name, consumption_size):
+    def min_max_dates_and_size_check(
+        data, name, consumption_size, window_from=None, window_to=None
+    ):
+        window_from = window_from or from_date
+        window_to = window_to or to_date
         min_date = utc.localize(data["from"].min().to_pydatetime())
         max_date = utc.localize(data["to"].max().to_pydatetime())
 
         if not (
-            min_date <= from_date
-            and max_date >= to_date
+            min_date <= window_from
+            and max_date >= window_to
             and consumption_size == data.shape[0]
         ):
             missing_days = abs((min_date - from_date).days + (max_date - to_date).days)
@@ -253,34 +444,182 @@ def _run_config(psql_config, data, energy_type, from_date, to_date, LDZ=None):
         _format_date(to_date),
     )
 
-    consumption_df = pd.concat(
-        _get_consumption(psql_config, dbname, from_date, to_date)
-        for dbname in data["consumption_dbs"]
-    ).sort_values("from")
+    if energy_type == "gas" and not LDZ:
+        raise ValueError(
+            "LDZ was not found for the property. Please add it manually in the Juice constructor."
+        )
 
-    consumption_size = consumption_df.shape[0]
-    min_max_dates_and_size_check(consumption_df, "consumption", consumption_size)
+    consumption_frames = {}
+    # methods evaluated in threads load each consumption frame once and share it without copies
+    consumption_lock = threading.Lock()
 
-    print("Total rows for consumption:", consumption_df.shape[0])
+    def get_consumption_key(group_by=None):
+        # identifies the consumption frame of a granularity and when its tables were last updated for the rate cache
+        if updates is None:
+            return None
 
-    if energy_type == "gas":
-        if not LDZ:
-            raise ValueError(
-                "LDZ was not found for the property. Please add it manually in the Juice constructor."
+        tables = tuple(
+            dbname + "_" + group_by if group_by else dbname
+            for dbname in data["consumption_dbs"]
+        )
+        if group_by:
+            # grouped totals are rounded from the half hours, so both are sources
+            tables += tuple(data["consumption_dbs"])
+        return (
+            (
+                tables,
+                partitioned_consumption,
+                _group_window(group_by, from_date, to_date),
+            ),
+            tuple(_updated(updates, table) for table in tables),
+        )
+
+    def get_consumption_frame(group_by=None):
+        with consumption_lock:
+            return load_consumption_frame(group_by)
+
+    def load_consumption_frame(group_by=None):
+        # each granularity is read once and shared by the methods using it
+        if group_by in consumption_frames:
+            return consumption_frames[group_by]
+
+        window_from, window_to = _group_window(group_by, from_date, to_date)
+
+        if group_by:
+            frames = (
+                _get_grouped_consumption(
+                    psql_config,
+                    dbname,
+                    group_by,
+                    window_from,
+                    window_to,
+                    data["meters"][index] if partitioned_consumption else None,
+                )
+                for index, dbname in enumerate(data["consumption_dbs"])
+            )
+            name = f"{group_by} consumption"
+        elif partitioned_consumption:
+            frames = (
+                _get_consumption(
+                    psql_config,
+                    PARTITIONED_CONSUMPTION_TABLE,
+                    from_date,
+                    to_date,
+                    meter,
+                )
+                for meter in data["meters"]
+            )
+            name = "consumption"
+        else:
+            frames = (
+                _get_consumption(psql_config, dbname, from_date, to_date)
+                for dbname in data["consumption_dbs"]
             )
-        data["_calorific_values"] = _join(
-            psql_config, "calorific_values", consumption_df, from_date, to_date, LDZ
-        ).sort_values("from")
+            name = "consumption"
+
+        consumption_df = pd.concat(frames).sort_values("from")
+
+        consumption_size = consumption_df.shape[0]
         min_max_dates_and_size_check(
-            data["_calorific_values"], "calorific values", consumption_size
+            consumption_df, name, consumption_size, window_from, window_to
         )
 
-    for method in data["methods"]:
+        print(f"Total rows for {name}:", consumption_size)
+
+        if energy_type == "gas":
+            key = _calorific_key(group_by)
+            data[key] = _join(
+                psql_config,
+                "calorific_values",
+                consumption_df,
+                from_date,
+                to_date,
+                LDZ,
+                rate_cache=rate_cache,
+                updates=updates,
+                consumption_key=get_consumption_key(group_by),
+            ).sort_values("from")
+            min_max_dates_and_size_check(
+                data[key], "calorific values", consumption_size
+            )
+
+        consumption_frames[group_by] = consumption_df
+        return consumption_df
+
+    # daily totals start at midnight in London, which only lines up with the UTC days of the calorific values for hourly totals
+    candidates = []
+    if group_by:
+        candidates = [
+            n
+            for n in GROUP_BY[GROUP_BY.index(group_by) :]
+            if energy_type != "gas" or n == "hour"
+        ]
+    if candidates and data["consumption_dbs"]:
+        existing_tables = query_existing_tables(
+            psql_config,
+            [
+                dbname + "_" + n
+                for dbname in data["consumption_dbs"]
+                for n in candidates
+            ],
+        )
+        candidates = [
+            n
+            for n in candidates
+            if all(
+                dbname + "_" + n in existing_tables
+                for dbname in data["consumption_dbs"]
+            )
+        ]
+        if not candidates:
+            print(
+                f"There are no {group_by} consumption totals stored for every meter, using half hours instead. Run update(group_by='{group_by}') to download them."
+            )
+
+    def evaluate(method):
         agreements = sorted(method["agreements"], key=lambda d: d["valid_from"])
 
-        print("Calculating", method["name"])
+        # other methods drop candidates whose totals turned out incomplete
+        with consumption_lock:
+            method_candidates = list(candidates)
+
+        group_by = _method_group_by(
+            psql_config,
+            method,
+            method_candidates,
+            from_date,
+            to_date,
+            unified_rates,
+            rate_cache,
+            updates,
+        )
+        if group_by:
+            try:
+                consumption_df = get_consumption_frame(group_by)
+            except (DatabaseError, KeyError, ValueError):
+                print(
+                    f"The {group_by} consumption totals do not cover the calculation, using half hours instead."
+                )
+                with consumption_lock:
+                    if group_by in candidates:
+                        candidates.remove(group_by)
+                group_by = None
+
+        if not group_by:
+            consumption_df = get_consumption_frame()
+
+        method["group_by"] = group_by
+        consumption_size = consumption_df.shape[0]
+        window_from, window_to = _group_window(group_by, from_date, to_date)
+
+        if group_by:
+            print("Calculating", method["name"], f"from {group_by} consumption totals")
+        else:
+            print("Calculating", method["name"])
         for cost_type in method["cost_types"]:
 
+            # the rates of an earlier calculation are never reused for this one
+            method["cost_types"][cost_type] = []
             tables = []
 
             for agreement in agreements:
@@ -290,9 +629,6 @@ def _run_config(psql_config, data, energy_type, from_date, to_date, LDZ=None):
                 valid_from = agreement["valid_from"]
                 valid_to = agreement["valid_to"]
 
-                if not valid_to:
-                    valid_to = datetime.now()
-
                 try:
                     standing_charge = agreement["standing_charge"]
                     unit_rate = agreement["unit_rate"]
@@ -302,7 +638,9 @@ def _run_config(psql_config, data, energy_type, from_date, to_date, LDZ=None):
                     else:
                         rate = standing_charge
 
-                    joined = _join_custom(rate, consumption_df, valid_from, valid_to)
+                    joined = _join_custom(
+                        rate, consumption_df, valid_from, valid_to or datetime.now()
+                    )
                     tables.append(joined)
 
                 # if there is no standing charge and unit rate specified then look up the information in the database
@@ -316,6 +654,10 @@ def _run_config(psql_config, data, energy_type, from_date, to_date, LDZ=None):
                             consumption_df,
                             valid_from,
                             valid_to,
+                            unified_rates=unified_rates,
+                            rate_cache=rate_cache,
+                            updates=updates,
+                            consumption_key=get_consumption_key(group_by),
                         )
 
                         tables.append(joined)
@@ -327,36 +669,795 @@ def _run_config(psql_config, data, energy_type, from_date, to_date, LDZ=None):
                 method["cost_types"][cost_type] = x
                 # print(method["cost_types"][cost_type])
                 min_max_dates_and_size_check(
-                    method["cost_types"][cost_type], method["name"], consumption_size
+                    method["cost_types"][cost_type],
+                    method["name"],
+                    consumption_size,
+                    window_from,
+                    window_to,
                 )
             except ValueError:
                 pass
 
+    _run_tasks([partial(evaluate, method) for method in data["methods"]], workers)
+
+    return {
+        **data,
+        "dataframe": _calc_costs(data, energy_type, consumption_frames),
+        "from_date": from_date,
+        "to_date": to_date,
+    }
+
+
+def _run_config_incremental(
+    psql_config,
+    data,
+    energy_type,
+    from_date,
+    to_date,
+    LDZ=None,
+    partitioned_consumption=False,
+    unified_rates=False,
+    rate_cache=None,
+    updates=None,
+    workers=None,
+    group_by=None,
+):
+    """
+    Calculate the methods with _run_config, reusing the results of the previous calculation. A method calculated before from the same from_date, whose inputs up to the previous to_date are unchanged, only has the rows after that to_date calculated and appended to its dataframe. The rest are calculated in full.
+    """
+
+    def run(methods, run_from, run_to):
+        subset = {**data, "methods": list(methods)}
+        _run_config(
+            psql_config,
+            subset,
+            energy_type,
+            run_from,
+            run_to,
+            LDZ,
+            partitioned_consumption,
+            unified_rates,
+            rate_cache,
+            updates,
+            workers,
+            group_by,
+        )
+
+        # methods without rates are dropped from the account as with a whole calculation
+        for method in methods:
+            if method not in subset["methods"]:
+                data["methods"].remove(method)
+
+    # the consumption summaries are shared by every method so each is queried once per calculation
+    summaries = {}
+
+    def inputs(method, inputs_to):
+        return _method_inputs(
+            psql_config,
+            data,
+            method,
+            energy_type,
+            from_date,
+            inputs_to,
+            LDZ,
+            partitioned_consumption,
+            unified_rates,
+            rate_cache,
+            updates,
+            summaries,
+        )
+
+    full = []
+    extend = {}
+    for method in data["methods"]:
+        previous = method.get("calculated")
+
+        # the dataframe must be the one the record was made for, as calculations without incremental replace it
+        if (
+            previous
+            and previous["dataframe"] is method.get("dataframe")
+            and previous["group_by"] == group_by
+            and previous["from_date"] == from_date
+            and previous["to_date"] <= to_date
+            and previous["inputs"]["method"] == _method_definition(method)
+            and (
+                previous["updated"] == _inputs_updated(previous["inputs"], updates)
+                or previous["inputs"] == inputs(method, previous["to_date"])
+            )
+        ):
+            extend.setdefault(previous["to_date"], []).append(method)
+        else:
+            full.append(method)
+
+    if full:
+        run(full, from_date, to_date)
+
+    reused = extend.pop(to_date, [])
+    if reused:
+        print(
+            "Reusing the previous calculation for",
+            ", ".join(method["name"] for method in reused),
+        )
+
+    for previous_to, methods in extend.items():
+        previous = {method["name"]: method["dataframe"] for method in methods}
+        run(methods, previous_to, to_date)
+
+        for method in methods:
+            if method in data["methods"]:
+                method["dataframe"] = pd.concat(
+                    [previous[method["name"]], method["dataframe"]], ignore_index=True
+                )
+
+    for method in data["methods"]:
+        if method in reused:
+            previous = method["calculated"]
+            previous["updated"] = _inputs_updated(previous["inputs"], updates)
+            continue
+
+        method_inputs = inputs(method, to_date)
+        method["calculated"] = {
+            "dataframe": method["dataframe"],
+            "group_by": group_by,
+            "from_date": from_date,
+            "to_date": to_date,
+            "inputs": method_inputs,
+            "updated": _inputs_updated(method_inputs, updates),
+        }
+
+    return {
+        **data,
+        "from_date": from_date,
+        "to_date": to_date,
+    }
+
+
+def _inputs_updated(inputs, updates):
+    # the update times of the sources behind a method's inputs, each input is keyed by its source's name and a detail
+    return {
+        name.split(" ")[0]: _updated(updates or {}, name.split(" ")[0])
+        for name in inputs
+        if name != "method"
+    }
+
+
+def _method_definition(method):
+    agreements = sorted(method["agreements"], key=lambda d: d["valid_from"])
+    return repr((agreements, sorted(method["cost_types"])))
+
+
+def _rates_digest(rates, from_date, to_date):
+    """
+    Return a hash of the rates as they apply between from_date and to_date, which changes only when the rates within the dates do.
+    """
+
+    start = pd.Timestamp(from_date).tz_convert(None)
+    end = pd.Timestamp(to_date).tz_convert(None)
+
+    # a column of only open ended rates is read with another resolution
+    valid_from = rates["valid_from"].astype("datetime64[ns]").fillna(pd.Timestamp.min)
+    valid_to = rates["valid_to"].astype("datetime64[ns]").fillna(pd.Timestamp.max)
+    inside = (valid_from < end) & (valid_to > start)
+
+    applied = pd.DataFrame(
+        {
+            "rate": rates["rate"][inside],
+            "valid_from": valid_from[inside].clip(lower=start),
+            "valid_to": valid_to[inside].clip(upper=end),
+        }
+    )
+
+    return int(pd.util.hash_pandas_object(applied, index=False).sum())
+
+
+def _method_inputs(
+    psql_config,
+    data,
+    method,
+    energy_type,
+    from_date,
+    to_date,
+    LDZ=None,
+    partitioned_consumption=False,
+    unified_rates=False,
+    rate_cache=None,
+    updates=None,
+    summaries=None,
+):
+    """
+    Return digests of the method's definition and of the consumption, rates and calorific values its costs between from_date and to_date are worked out from. Each is keyed by the name its source is marked as updated under, followed by a detail for rates. summaries holds the consumption summaries already queried and is filled in with new ones.
+    """
+
+    if summaries is None:
+        summaries = {}
+
+    agreements = sorted(method["agreements"], key=lambda d: d["valid_from"])
+    result = {"method": _method_definition(method)}
+
+    for index, dbname in enumerate(data["consumption_dbs"]):
+        if partitioned_consumption:
+            source = (PARTITIONED_CONSUMPTION_TABLE, data["meters"][index])
+        else:
+            source = (dbname, None)
+
+        key = (dbname, from_date, to_date)
+        if key not in summaries:
+            summaries[key] = summarise_consumption(
+                psql_config, [source], from_date, to_date
+            )
+
+        result[dbname] = summaries[key]
+
+        # a method costed from consumption totals also depends on them, over the window they cover
+        if method.get("group_by"):
+            table_name = dbname + "_" + method["group_by"]
+            window = _group_window(method["group_by"], from_date, to_date)
+            key = (table_name, *window)
+            if key not in summaries:
+                summaries[key] = summarise_consumption(
+                    psql_config, [(table_name, None)], *window
+                )
+
+            result[table_name] = summaries[key]
+
+    for agreement in agreements:
+        if "tariff_code" not in agreement:
+            continue
+
+        valid_from = _to_datetime(agreement["valid_from"])
+        valid_to = _to_datetime(agreement["valid_to"])
+
+        start = max(valid_from, from_date)
+        end = min(valid_to or to_date, to_date)
+        if start >= end:
+            continue
+
+        for cost_type in method["cost_types"]:
+            dbname = agreement["tariff_code"] + cost_type
+            try:
+                rates = _rate_frame(
+                    psql_config,
+                    dbname,
+                    valid_from,
+                    valid_to,
+                    unified_rates=unified_rates,
+                    rate_cache=rate_cache,
+                    updates=updates,
+                )
+                digest = _rates_digest(rates, start, end)
+            except ValueError:
+                digest = None
+
+            result[f"{dbname} {valid_from.isoformat()}"] = digest
+
+    if energy_type == "gas":
+        try:
+            rates = _rate_frame(
+                psql_config,
+                "calorific_values",
+                from_date,
+                to_date,
+                LDZ,
+                rate_cache=rate_cache,
+                updates=updates,
+            )
+            digest = _rates_digest(rates, from_date, to_date)
+        except ValueError:
+            digest = None
+
+        result["calorific_values_" + LDZ] = digest
+
+    return result
+
+
+def _run_config_sql(
+    psql_config,
+    data,
+    energy_type,
+    from_date,
+    to_date,
+    LDZ=None,
+    partitioned_consumption=False,
+    unified_rates=False,
+    rollup=False,
+):
+    """
+    Calculate the methods inside PostgresQL, leaving one row per day in each method's dataframe instead of one per half hour. With rollup, whole days are read from the daily costs table.
+    """
+
+    utc = timezone("UTC")
+
+    if partitioned_consumption:
+        consumption_sources = [
+            (PARTITIONED_CONSUMPTION_TABLE, meter) for meter in data["meters"]
+        ]
+    else:
+        consumption_sources = [(dbname, None) for dbname in data["consumption_dbs"]]
+
+    if energy_type == "gas" and not LDZ:
+        raise ValueError(
+            "LDZ was not found for the property. Please add it manually in the Juice constructor."
+        )
+    elif energy_type != "gas":
+        LDZ = None
+
+    print(
+        "Getting consumption figures from",
+        _format_date(from_date),
+        "to",
+        _format_date(to_date),
+    )
+
+    consumption_size = count_consumption(
+        psql_config, consumption_sources, from_date, to_date
+    )
+    print("Total rows for consumption:", consumption_size)
+
+    existing_tables = set()
+    if not unified_rates:
+        existing_tables = query_existing_tables(
+            psql_config,
+            [
+                agreement["tariff_code"] + cost_type
+                for method in data["methods"]
+                for agreement in method["agreements"]
+                if "tariff_code" in agreement
+                for cost_type in method["cost_types"]
+            ],
+        )
+
+    columns = [
+        "from",
+        "rows",
+        "consumption",
+        "consumption_rounded",
+        "consumption_units",
+        "calorific_value",
+        "cost",
+    ]
+
+    methods_del = []
+    for method in data["methods"]:
+        name = method["name"]
+
+        print("Calculating", name)
+
+        df = None
+        for cost_type, cost_column in [
+            ("_standard_unit_rates", name + "_cost_unit_rate"),
+            ("_standing_charges", name + "_cost_standing_charge"),
+        ]:
+
+            rate_sources = []
+            for agreement in method["agreements"]:
+                if agreement["valid_from"] == agreement["valid_to"]:
+                    continue
+
+                source = {
+                    "valid_from": agreement["valid_from"],
+                    "valid_to": agreement["valid_to"] or datetime.now(utc),
+                }
+
+                if "unit_rate" in agreement:
+                    if cost_type == "_standard_unit_rates":
+                        source["rate"] = agreement["unit_rate"]
+                    else:
+                        source["rate"] = agreement["standing_charge"]
+                elif unified_rates:
+                    source["tariff_code"] = agreement["tariff_code"]
+                    source["unified"] = True
+                elif agreement["tariff_code"] + cost_type in existing_tables:
+                    source["tariff_code"] = agreement["tariff_code"]
+                else:
+                    continue
+
+                rate_sources.append(source)
+
+            if not rate_sources:
+                continue
+
+            if rollup:
+                s = _rollup_daily_costs(
+                    psql_config,
+                    data["consumption_dbs"],
+                    consumption_sources,
+                    rate_sources,
+                    cost_type,
+                    from_date,
+                    to_date,
+                    LDZ,
+                )
+            else:
+                s = retrive_daily_costs(
+                    psql_config,
+                    consumption_sources,
+                    rate_sources,
+                    cost_type,
+                    from_date,
+                    to_date,
+                    LDZ,
+                )
+
+            if not s:
+                continue
+
+            costs = pd.DataFrame(s, columns=columns)
+            for column in columns[2:]:
+                costs[column] = costs[column].astype(np.float64)
+            costs["from"] = costs["from"].dt.tz_convert(None)
+
+            if rollup:
+                # days split between agreements or between the rollup and its edges are added back together
+                costs = costs.groupby("from", as_index=False).agg(
+                    {
+                        "rows": "sum",
+                        "consumption": "sum",
+                        "consumption_rounded": "sum",
+                        "consumption_units": "sum",
+                        "calorific_value": "mean",
+                        "cost": "sum",
+                    }
+                )
+
+            if costs["rows"].sum() != consumption_size:
+                raise DatabaseError(
+                    f"There is {consumption_size - costs['rows'].sum()} half hour(s) of missing data for {name}. The required range is {_format_date(from_date)} to {_format_date(to_date)}. Is the database up to date? Try running update()."
+                )
+
+            costs = costs.rename(columns={"cost": cost_column}).drop(columns="rows")
+
+            if df is None:
+                df = costs
+            else:
+                df = pd.merge(df, costs[["from", cost_column]], on="from")
+
+        if df is None:
+            methods_del.append(method)
+            continue
+
+        # a day in London lasts 23 or 25 hours when the clocks change
+        df.insert(
+            1,
+            "to",
+            (
+                df["from"].dt.tz_localize("UTC").dt.tz_convert("Europe/London")
+                + pd.DateOffset(days=1)
+            ).dt.tz_convert(None),
+        )
+
+        if energy_type != "gas":
+            df = df.drop(columns=["consumption_units", "calorific_value"])
+
+        cost_columns = [
+            column
+            for column in [name + "_cost_unit_rate", name + "_cost_standing_charge"]
+            if column in df
+        ]
+        df[name + "_total"] = df[cost_columns].sum(axis=1)
+
+        method["dataframe"] = df
+
+    for method in methods_del:
+        data["methods"].remove(method)
+
     return {
         **data,
-        "dataframe": _calc_costs(data, energy_type),
         "from_date": from_date,
         "to_date": to_date,
     }
 
 
+def _rollup_daily_costs(
+    psql_config,
+    meters,
+    consumption_sources,
+    rate_sources,
+    cost_type,
+    from_date,
+    to_date,
+    LDZ=None,
+):
+    """
+    Return daily cost rows for the rate sources, reading whole days from the rollup table and costing only the partial days at the edges of each agreement from the half hour data.
+    """
+
+    rows = []
+    for source in rate_sources:
+        start = max(source["valid_from"], from_date)
+        end = min(source["valid_to"], to_date)
+        if start >= end:
+            continue
+
+        first_day = _ceil_day(start)
+        last_day = _floor_day(end)
+
+        if "rate" in source or first_day >= last_day:
+            rows.extend(
+                retrive_daily_costs(
+                    psql_config,
+                    consumption_sources,
+                    [source],
+                    cost_type,
+                    start,
+                    end,
+                    LDZ,
+                )
+            )
+            continue
+
+        _refresh_rollups(
+            psql_config, meters, consumption_sources, source, cost_type, LDZ
+        )
+
+        rows.extend(
+            retrive_rollup_costs(
+                psql_config,
+                meters,
+                source["tariff_code"],
+                cost_type,
+                first_day,
+                last_day,
+            )
+        )
+
+        for edge_from, edge_to in [(start, first_day), (last_day, end)]:
+            if edge_from < edge_to:
+                rows.extend(
+                    retrive_daily_costs(
+                        psql_config,
+                        consumption_sources,
+                        [source],
+                        cost_type,
+                        edge_from,
+                        edge_to,
+                        LDZ,
+                    )
+                )
+
+    return rows
+
+
+def _refresh_rollups(psql_config, meters, consumption_sources, source, cost_type, LDZ):
+    """
+    Bring the daily costs of each meter on the source's tariff up to date when the consumption or rates were updated after the last rollup.
+
+    Besides the last rolled up day, every day from the earliest one whose half hours, consumption or rates no longer match is recomputed, which picks up backfilled consumption, rates downloaded later for older days and rates corrected in place.
+    """
+
+    utc = timezone("UTC")
+
+    tariff_code = source["tariff_code"]
+    rollup_source = {
+        **source,
+        "valid_from": utc.localize(datetime(1900, 1, 1)),
+        "valid_to": utc.localize(datetime(3000, 1, 1)),
+    }
+
+    create_daily_costs_db(psql_config)
+    rates_updated = max(
+        query_updates(psql_config, tariff_code + cost_type),
+        query_updates(psql_config, tariff_code + cost_type + WINDOW_UPDATES_SUFFIX),
+    )
+
+    for meter, consumption_source in zip(meters, consumption_sources):
+        update_name = f"{DAILY_COSTS_TABLE}_{meter}_{tariff_code}{cost_type}"
+
+        rolled_up = query_updates(psql_config, update_name)
+        meter_updated = max(
+            query_updates(psql_config, meter),
+            query_updates(psql_config, meter + IMPORT_UPDATES_SUFFIX),
+        )
+        if rolled_up >= max(rates_updated, meter_updated):
+            continue
+
+        # the last rolled up day is recomputed as it may have been incomplete
+        latest = query_latest_daily_cost(psql_config, meter, tariff_code, cost_type)
+        if latest:
+            refresh_from = _floor_day(latest - timedelta(days=1))
+
+            stale = query_earliest_stale_daily_cost(
+                psql_config,
+                meter,
+                consumption_source,
+                rollup_source,
+                cost_type,
+                LDZ,
+                rates_changed=rates_updated > rolled_up,
+            )
+            if stale and stale < refresh_from:
+                refresh_from = stale
+        else:
+            refresh_from = rollup_source["valid_from"]
+
+        print(f"Rolling up daily costs for {meter} on {tariff_code}{cost_type}.")
+        refresh_daily_costs(
+            psql_config,
+            meter,
+            consumption_source,
+            rollup_source,
+            cost_type,
+            refresh_from,
+            datetime.now(utc),
+            LDZ,
+        )
+        insert_updates(psql_config, update_name)
+
+
+def _calorific_key(group_by=None):
+    if group_by:
+        return "_calorific_values_" + group_by
+    return "_calorific_values"
+
+
+def _on_boundary(dates, group_by):
+    # dates is a DatetimeIndex, checked in London time where the daily totals begin
+    local = dates.tz_convert("Europe/London")
+    on_hour = (
+        (local.minute == 0)
+        & (local.second == 0)
+        & (local.microsecond == 0)
+        & (local.nanosecond == 0)
+    )
+    if group_by == "day":
+        return on_hour & (local.hour == 0)
+    return on_hour
+
+
+def _method_group_by(
+    psql_config,
+    method,
+    candidates,
+    from_date,
+    to_date,
+    unified_rates=False,
+    rate_cache=None,
+    updates=None,
+):
+    """
+    Return the first of the candidates, "day" or "hour", within which none of the method's agreements or rates change over the calculation's window for it. None means the method needs half hours.
+    """
+
+    if not candidates:
+        return None
+
+    windows = {
+        group_by: _group_window(group_by, from_date, to_date) for group_by in candidates
+    }
+    start = min(window[0] for window in windows.values())
+    end = max(window[1] for window in windows.values())
+
+    boundaries = []
+    rate_dates = []
+    for agreement in method["agreements"]:
+        valid_from = _to_datetime(agreement["valid_from"])
+        valid_to = _to_datetime(agreement["valid_to"])
+
+        if valid_from == valid_to or valid_from >= end:
+            continue
+        if valid_to and valid_to <= start:
+            continue
+
+        boundaries += [valid_from, valid_to]
+
+        if "tariff_code" not in agreement:
+            continue
+
+        for cost_type in method["cost_types"]:
+            # the agreement's whole window is read so the rates are cached for the join that follows
+            try:
+                rates = _rate_frame(
+                    psql_config,
+                    agreement["tariff_code"] + cost_type,
+                    valid_from,
+                    valid_to,
+                    unified_rates=unified_rates,
+                    rate_cache=rate_cache,
+                    updates=updates,
+                )
+            except ValueError:
+                continue
+
+            rate_dates += [rates["valid_from"], rates["valid_to"]]
+
+    # the rates are checked as arrays since a half hourly tariff has tens of thousands of them
+    dates = pd.DatetimeIndex(
+        pd.concat(
+            [pd.to_datetime(pd.Series([d for d in boundaries if d]), utc=True)]
+            + [d.dt.tz_localize("UTC") for d in rate_dates]
+        ).dropna()
+    )
+
+    for group_by, (window_from, window_to) in windows.items():
+        inside = dates[(dates > window_from) & (dates < window_to)]
+        edges = pd.DatetimeIndex(pd.to_datetime([window_from, window_to], utc=True))
+        if _on_boundary(inside.append(edges), group_by).all():
+            return group_by
+
+    return None
+
+
+def _group_window(group_by, from_date, to_date):
+    # daily totals begin at midnight in London, so a calculation from them covers the London days of its dates
+    if group_by == "day":
+        return _floor_day(from_date), _floor_day(to_date)
+    return from_date, to_date
+
+
+def _floor_day(date):
+    # days begin at midnight in London, like the daily costs
+    london = timezone("Europe/London")
+    day = date.astimezone(london).replace(
+        hour=0, minute=0, second=0, microsecond=0, tzinfo=None
+    )
+    return london.localize(day)
+
+
+def _ceil_day(date):
+    floor = _floor_day(date)
+    if floor == date:
+        return floor
+    return timezone("Europe/London").localize(
+        floor.replace(tzinfo=None) + timedelta(days=1)
+    )
+
+
 def calculate(
     self,
     from_date: None | str | datetime = None,
     to_date: None | str | datetime = None,
     energy_type: None | str = None,
+    engine: str = "pandas",
+    lazy: bool = False,
+    workers: int | None = 4,
+    incremental: bool = False,
+    method_workers: int | None = None,
+    group_by: str | None = None,
 ):
     """
-    Calculate costs for the methods added.
+    Calculate costs for the methods added. With the pandas engine, the rates read for a calculation are kept in account.rate_cache and reused until they are updated.
+
+    Examples:
+        >>> account.calculate()
+        >>> account.calculate('2023-01-15', '2024-04-16', engine='sql')
+        >>> account.calculate('2024-03-01', '2024-04-01', lazy=True)
+        >>> account.calculate(incremental=True)
+        >>> account.calculate(method_workers=8)
+        >>> account.calculate(group_by='day')
 
     Args:
         from_date: A date from which to begin calculations.
         to_date: A date to which calculate.
+        energy_type: The energy type to calculate.
+        engine: Either "pandas" to cost every half hour in Python, "sql" to cost inside PostgresQL and keep one row per day or "rollup" to also read whole days from the persisted daily costs. Daily rows begin at midnight in London.
+        lazy: Whether to first download the rates the methods need between the dates that are not stored yet, instead of relying on update().
+        workers: The number of tariffs downloaded at the same time with lazy.
+        incremental: Whether the pandas engine extends the results of the previous calculation from the same from_date with the days after its to_date, when nothing those results were worked out from has changed, instead of calculating every method again.
+        method_workers: The number of methods the pandas engine evaluates at the same time in a thread pool, sharing the consumption figures between them. None evaluates them one after another.
+        group_by: Whether the pandas engine costs methods whose rates do not change within a day ("day") or an hour ("hour") from the consumption totals downloaded with update(group_by=...), instead of half hours. "day" also uses hourly totals where the rates change within a day, and daily rows cover the London days of the dates. The totals are rounded as the sum of their rounded half hours, so the costs are those of the half hours.
 
     Returns:
         None
     """
 
+    if engine not in ENGINES:
+        raise ValueError(
+            f'engine must either be "pandas", "sql" or "rollup". The function received: {engine}'
+        )
+
+    if self.embedded and engine != "pandas":
+        raise ValueError(
+            f'The "{engine}" engine needs a PostgresQL database. Use the "pandas" engine with the embedded database.'
+        )
+
+    if group_by is not None and group_by not in GROUP_BY:
+        raise ValueError(
+            f'group_by must either be None, "day" or "hour". The function received: {group_by}'
+        )
+    if group_by and engine != "pandas":
+        raise ValueError(
+            f'group_by is only available with the "pandas" engine. The function received: {engine}'
+        )
+
     if energy_type is None:
         energy_type = self.energy_type
     self._check_energy_type_input(energy_type)
@@ -383,8 +1484,118 @@ def calculate(
 
     _check_method_dates(data["methods"], from_date, to_date)
 
-    data = _run_config(
-        self.psql_config, data, energy_type, from_date, to_date, self.LDZ
+    if lazy:
+        _fetch_missing_rates(self, data["methods"], from_date, to_date, workers)
+
+    if engine == "pandas" and incremental:
+        data = _run_config_incremental(
+            self.psql_pool,
+            data,
+            energy_type,
+            from_date,
+            to_date,
+            self.LDZ,
+            self.partitioned_consumption,
+            self.unified_rates,
+            self.rate_cache,
+            query_all_updates(self.psql_pool),
+            method_workers,
+            group_by,
+        )
+    elif engine == "pandas":
+        # the results can only be extended by an incremental calculation that made them
+        for method in data["methods"]:
+            method.pop("calculated", None)
+
+        data = _run_config(
+            self.psql_pool,
+            data,
+            energy_type,
+            from_date,
+            to_date,
+            self.LDZ,
+            self.partitioned_consumption,
+            self.unified_rates,
+            self.rate_cache,
+            query_all_updates(self.psql_pool),
+            method_workers,
+            group_by,
+        )
+    else:
+        for method in data["methods"]:
+            method.pop("calculated", None)
+
+        data = _run_config_sql(
+            self.psql_pool,
+            data,
+            energy_type,
+            from_date,
+            to_date,
+            self.LDZ,
+            self.partitioned_consumption,
+            self.unified_rates,
+            rollup=engine == "rollup",
+        )
+
+
+def _rate_slices(methods, from_date, to_date):
+    """
+    Return the tariff code, cost type and date window of every stored tariff the methods use between from_date and to_date. The windows of a tariff used more than once are merged.
+    """
+
+    slices = {}
+    for method in methods:
+        for agreement in method["agreements"]:
+            if "tariff_code" not in agreement:
+                continue
+
+            start = max(_to_datetime(agreement["valid_from"]), from_date)
+            end = min(_to_datetime(agreement["valid_to"]) or to_date, to_date)
+            if start >= end:
+                continue
+
+            for cost_type in method["cost_types"]:
+                key = (agreement["tariff_code"], cost_type.lstrip("_"))
+                if key in slices:
+                    start, end = min(start, slices[key][0]), max(end, slices[key][1])
+                slices[key] = (start, end)
+
+    return [
+        {"tariff_code": tariff_code, "cost_type": cost_type, "from": start, "to": end}
+        for (tariff_code, cost_type), (start, end) in slices.items()
+    ]
+
+
+def _fetch_missing_rates(self, methods, from_date, to_date, workers=None):
+    """
+    Download the windows of the rates the methods need that are not stored, leaving every other tariff alone.
+    """
+
+    slices = query_missing_rate_slices(
+        self.psql_pool, _rate_slices(methods, from_date, to_date), self.unified_rates
+    )
+
+    if not slices:
+        print("All the rates needed for the calculation are stored.")
+        return
+
+    _create_shared_tables(self)
+
+    _run_tasks(
+        [
+            partial(
+                self._get_tariffs,
+                self.psql_pool,
+                s["tariff_code"],
+                session=self.session,
+                unified=self.unified_rates,
+                period_from=s["from"],
+                period_to=s["to"],
+                cost_types=[s["cost_type"]],
+            )
+            for s in slices
+        ],
+        workers,
     )
 
 
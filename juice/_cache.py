@@ -0,0 +1,67 @@
+from collections import OrderedDict
+import threading
+
+
+class RateCache:
+    """
+    A thread safe in-process cache of rate frames and joined rates holding at most max_size bytes. The least recently used entries are evicted first.
+
+    Every entry keeps the update times of the sources it was read from and is dropped once they change.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, updated):
+
+        with self.lock:
+            entry = self.entries.get(key)
+
+            if entry is None or entry[0] != updated:
+                self.misses += 1
+                if entry is not None:
+                    self._remove(key)
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, updated, frame):
+
+        size = int(frame.memory_usage(index=True).sum())
+        if size > self.max_size:
+            return
+
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+
+            self.entries[key] = (updated, frame, size)
+            self.size += size
+
+            while self.size > self.max_size:
+                self._remove(next(iter(self.entries)))
+
+    def _remove(self, key):
+        self.size -= self.entries.pop(key)[2]
+
+    def clear(self):
+
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def info(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self.entries),
+            "size": self.size,
+            "max_size": self.max_size,
+        }
@@ -1,7 +1,78 @@
 OCOTPUS_API_BASE_URL = "https://api.octopus.energy/v1"
 PAGE_SIZE = 150
+# the largest page_size the Octopus API accepts
+MAX_PAGE_SIZE = 1500
 UPDATE_INTERVAL = 3
 
+# hours each kind of source is considered fresh after it was last updated
+# products and calorific values are published once a day and rates that have all ended almost never change
+FRESHNESS = {
+    "consumption": UPDATE_INTERVAL,
+    "products": 24,
+    "calorific_values": 24,
+    "standard_unit_rates": UPDATE_INTERVAL,
+    "standing_charges": 24,
+    "historic_rates": 24 * 30,
+}
+# day-ahead rates such as Agile are published about 8 hours before the last stored rate ends
+DAY_AHEAD_LEAD = 8
+
+# settings for network requests, rate is in requests per second and burst is the most requests sent back to back
+# page_workers is how many pages of a paginated endpoint are downloaded at the same time
+# cache is a path to a SQLite file of responses holding at most cache_size bytes, None disables it
+HTTP_CONFIG = {
+    "retries": 5,
+    "backoff_factor": 0.5,
+    "rate": 4,
+    "burst": 8,
+    "pool_connections": 4,
+    "pool_maxsize": 8,
+    "page_size": PAGE_SIZE,
+    "page_workers": 4,
+    "cache": None,
+    "cache_size": 256 * 1024**2,
+}
+
+# consumption totals the API can group by, from the coarsest
+GROUP_BY = ["day", "hour"]
+
+PARTITIONED_CONSUMPTION_TABLE = "meter_consumption"
+TARIFF_RATES_TABLE = "tariff_rates"
+PRODUCT_TARIFFS_TABLE = "product_tariffs"
+DAILY_COSTS_TABLE = "daily_costs"
+# downloads of a window of a source are recorded under its name with this suffix, so they are seen by
+# calculations without counting as a refresh of the whole source
+WINDOW_UPDATES_SUFFIX = "_window"
+# consumption imported from a file is recorded under its table's name with this suffix, so it is seen by calculations
+# without counting as a sync from the API
+IMPORT_UPDATES_SUFFIX = "_import"
+
+# columns the embedded storage backend parses into timestamps before loading
+EMBEDDED_TIMESTAMP_COLUMNS = {
+    "interval_start",
+    "interval_end",
+    "valid_from",
+    "valid_to",
+    "available_from",
+    "available_to",
+    "applicable_date",
+}
+
+# rows loaded into the embedded storage backend per batch by streaming inserts
+EMBEDDED_BATCH_SIZE = 50000
+# rows read from a consumption file and loaded per batch by import_consumption
+IMPORT_BATCH_SIZE = 50000
+# the most bytes of rate frames and joined rates kept in memory between calculations
+RATE_CACHE_SIZE = 512 * 1024**2
+
+# settings passed on to psycopg_pool.ConnectionPool, max_lifetime and max_idle are in seconds
+POOL_CONFIG = {
+    "min_size": 1,
+    "max_size": 4,
+    "max_lifetime": 3600,
+    "max_idle": 600,
+}
+
 OCTOPUS_SMART_TARIFF_FAMILIES = [
     "Agile Octopus",
     "Octopus Go",
@@ -1,10 +1,24 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from functools import partial
 from ._psql import (
     create_updates_table,
+    query_all_updates,
+    query_rates_coverage,
     query_octopus_product_by_family_name,
     query_octopus_product_by_product_code,
-    query_octopus_product_not_in_database
+    query_octopus_product_not_in_database,
+    migrate_consumption_table,
+    create_consumption_db,
+    insert_consumption,
+    create_partitioned_consumption_db,
+    create_tariff_rates_db,
+    insert_partitioned_consumption,
+    insert_updates
 )
 from ._get import _octopus_custom_products_download
+from ._import import read_consumption_batches
+from ._data import GROUP_BY, IMPORT_UPDATES_SUFFIX
 
 
 def update_products_database_by_product_code(self, product_codes: list | str):
@@ -30,15 +44,15 @@ def update_products_database_by_product_code(self, product_codes: list | str):
     if isinstance(product_codes, str):
         product_codes = [product_codes]
 
-    products  = query_octopus_product_not_in_database(self.psql_config, product_codes)
+    products  = query_octopus_product_not_in_database(self.psql_pool, product_codes)
     if not products:
         print('All the products are already in the database.')
         return
     
-    _octopus_custom_products_download(self.psql_config, products, self.headers)
+    _octopus_custom_products_download(self.psql_pool, products, self.session)
 
 
-def update_by_tariff_code(self, tariff_codes: list, force_refresh: bool | None = None):
+def update_by_tariff_code(self, tariff_codes: list, force_refresh: bool | None = None, incremental: bool | None = False, period_from: datetime | None = None, period_to: datetime | None = None, workers: int | None = None):
 
     """
     Update/create databases of supplied Octopus tariff codes.
@@ -52,6 +66,10 @@ def update_by_tariff_code(self, tariff_codes: list, force_refresh: bool | None =
     Args:
         tariff_codes: A list of Octopus tariff codes to update.
         force_refresh: Whether to delete and recreate the databases.
+        incremental: Whether to only download rates from the newest one already stored.
+        period_from: Only download rates valid from this date.
+        period_to: Only download rates valid before this date.
+        workers: The number of tariffs to update at the same time.
 
     Returns:
         None
@@ -60,16 +78,10 @@ def update_by_tariff_code(self, tariff_codes: list, force_refresh: bool | None =
     if isinstance(tariff_codes, str):
         tariff_codes = [tariff_codes]
 
-    for entry in tariff_codes:
-        self._get_tariffs(
-            self.psql_config,
-            entry["tariff_code"],
-            force_refresh=force_refresh,
-            headers=self.headers,
-        )
+    _update_tariffs(self, tariff_codes, force_refresh, incremental, period_from, period_to, workers)
 
 
-def update_existing_products(self, force_refresh: bool | None =None):
+def update_existing_products(self, force_refresh: bool | None =None, incremental: bool | None = False, workers: int | None = None):
 
     """
     Update existing Octopus tariff databases.
@@ -79,6 +91,8 @@ def update_existing_products(self, force_refresh: bool | None =None):
 
     Args:
         force_refresh: Whether to delete and recreate the databases.
+        incremental: Whether to only download rates from the newest one already stored.
+        workers: The number of tariffs to update at the same time.
 
     Returns:
         None
@@ -86,8 +100,8 @@ def update_existing_products(self, force_refresh: bool | None =None):
     """
 
 
-    tariff_codes = self.query_existing_products_tables(self.psql_config)
-    self.update_by_tariff_code(tariff_codes, force_refresh)
+    tariff_codes = self.query_existing_products_tables(self.psql_pool, self.unified_rates)
+    self.update_by_tariff_code(tariff_codes, force_refresh, incremental, workers=workers)
 
 
 def update_by_product_code(self, product_codes: list | str, force_refresh: bool | None = None, energy_type: str | None = None):
@@ -123,7 +137,7 @@ def update_by_product_code(self, product_codes: list | str, force_refresh: bool
     for product_name in product_codes:
         tariff_codes.extend(
             query_octopus_product_by_product_code(
-                self.psql_config, product_name, energy_type, self.GSP
+                self.psql_pool, product_name, energy_type, self.GSP
             )
         )
 
@@ -164,7 +178,7 @@ def update_by_product_family(self, product_families: list | str, force_refresh:
     for product_name in product_families:
         tariff_codes.extend(
             query_octopus_product_by_family_name(
-                self.psql_config, product_name, energy_type, self.GSP
+                self.psql_pool, product_name, energy_type, self.GSP
             )
         )
 
@@ -173,16 +187,22 @@ def update_by_product_family(self, product_families: list | str, force_refresh:
     
 
 
-def update(self, force_refresh: bool | None = False):
+def update(self, force_refresh: bool | None = False, incremental: bool | None = False, workers: int | None = None, group_by: str | None = None):
 
     """
     Update/create consumption, account tariffs, Octopus products and existing tariff databases.
 
     Examples:
         >>> account.update()
+        >>> account.update(incremental=True)
+        >>> account.update(workers=8)
+        >>> account.update(group_by='day')
 
     Args:
         force_refresh: Whether to delete and recreate the databases.
+        incremental: Whether to only download consumption and rates newer than what is already stored.
+        workers: The number of meters, tariffs and LDZs to update at the same time. Requests share the account's rate limit and database writes share its connection pool.
+        group_by: Also download daily ("day") or hourly ("hour") consumption totals, besides the half hours. calculate(group_by=...) uses them for methods whose rates do not change within a day or an hour.
 
     Returns:
         None
@@ -191,27 +211,210 @@ def update(self, force_refresh: bool | None = False):
 
     print(f'Updating {self.ACCOUNT_DATA['number']}.')
 
-    create_updates_table(self.psql_config)
+    create_updates_table(self.psql_pool)
 
-    for consumption in self.CONSUMPTION:
-        self._get_consumption(self.psql_config, self.API_KEY,
-                                account_id=self.ACCOUNT_ID,
-                                force_refresh=force_refresh,
-                                headers=self.headers,
-                                **consumption)
+    # loaded once so every source checks its freshness without a query of its own
+    updates = query_all_updates(self.psql_pool)
+    coverage = query_rates_coverage(self.psql_pool, self.unified_rates)
+
+    if group_by is not None and group_by not in GROUP_BY:
+        raise ValueError(f'group_by must either be None, "day" or "hour". The function received: {group_by}')
 
-    for tariff in self.AGREEMENTS:
-        self._get_tariffs(self.psql_config, tariff['tariff_code'], force_refresh=force_refresh, headers=self.headers)
+    if self.calcs['gas']['consumption_dbs'] and not self.LDZ:
+        raise ValueError('There were gas consumption databases found but no LDZ. Please add it to the Juice constructor.')
 
-    self._get_octopus_products(self.psql_config, self.headers)
+    _create_shared_tables(self)
+
+    tasks = []
+
+    # grouped totals are downloaded alongside the half hours, which methods whose rates change within them still need
+    for consumption in self.CONSUMPTION:
+        for n in dict.fromkeys([None, group_by]):
+            tasks.append(partial(self._get_consumption, self.psql_pool, self.API_KEY,
+                                    account_id=self.ACCOUNT_ID,
+                                    force_refresh=force_refresh,
+                                    session=self.session,
+                                    partitioned=self.partitioned_consumption,
+                                    incremental=incremental,
+                                    updates=updates,
+                                    group_by=n,
+                                    **consumption))
+
+    # a tariff shared by several agreements only needs downloading once
+    for tariff_code in dict.fromkeys(tariff['tariff_code'] for tariff in self.AGREEMENTS):
+        tasks.append(partial(self._get_tariffs, self.psql_pool, tariff_code, force_refresh=force_refresh, session=self.session, unified=self.unified_rates, incremental=incremental, updates=updates, coverage=coverage))
+
+    tasks.append(partial(self._get_octopus_products, self.psql_pool, self.session, updates))
 
     if self.calcs['gas']['consumption_dbs']:
-        if not self.LDZ:
-            raise ValueError('There were gas consumption databases found but no LDZ. Please add it to the Juice constructor.')
-        for x in self.ACCOUNT_DATA['properties']:
-            self._get_calorific_values(self.psql_config, x['moved_in_at'], self.LDZ, headers=self.headers)
+        # a single download covers every property from the earliest move in date
+        moved_in_at = min((x['moved_in_at'] for x in self.ACCOUNT_DATA['properties']), key=datetime.fromisoformat)
+        tasks.append(partial(self._get_calorific_values, self.psql_pool, moved_in_at, self.LDZ, session=self.session, updates=updates))
 
-    self.update_existing_products(force_refresh)
+    _run_tasks(tasks, workers)
+
+    # the account's tariffs were just updated so they are skipped here
+    tariff_codes = self.query_existing_products_tables(self.psql_pool, self.unified_rates)
+    _update_tariffs(self, tariff_codes, force_refresh, incremental, workers=workers, updates=updates, coverage=coverage)
 
     print('Completed update.')
     print('='*15)
+
+
+def backfill_consumption(self):
+
+    """
+    Download the consumption data missing between already stored intervals.
+
+    Examples:
+        >>> account.backfill_consumption()
+
+    Returns:
+        None
+        
+    """
+
+    for consumption in self.CONSUMPTION:
+        self._backfill_consumption(self.psql_pool, self.API_KEY,
+                                   account_id=self.ACCOUNT_ID,
+                                   session=self.session,
+                                   partitioned=self.partitioned_consumption,
+                                   **consumption)
+
+
+def migrate_consumption_tables(self, drop: bool | None = False):
+
+    """
+    Copy the account's per meter consumption tables into the partitioned consumption table.
+
+    Examples:
+        >>> account.migrate_consumption_tables()
+
+    Args:
+        drop: Whether to drop the per meter tables once they have been copied.
+
+    Returns:
+        None
+        
+    """
+
+    if self.embedded:
+        raise ValueError('migrate_consumption_tables needs a PostgresQL database. The embedded database only stores consumption in per meter tables.')
+
+    for energy_type in ['gas', 'electricity']:
+        data = self.calcs[energy_type]
+        for table_name, meter in zip(data['consumption_dbs'], data['meters']):
+            migrate_consumption_table(self.psql_pool, table_name, meter, drop)
+
+    print('Completed migration.')
+
+
+def import_consumption(self, path: str, mpan_or_mprn: str | None = None, serial_number: str | None = None, columns: dict | None = None):
+
+    """
+    Load consumption from a local CSV or Parquet file, e.g. a smart meter export or an archived dump, instead of downloading it. Intervals already stored are replaced by the ones in the file.
+
+    Examples:
+        >>> account.import_consumption('consumption.csv')
+        >>> account.import_consumption('archive.parquet', '1200000000000', '21L0000000')
+        >>> account.import_consumption('export.csv', columns={'kWh': 'consumption', 'From': 'interval_start', 'To': 'interval_end'})
+
+    Args:
+        path: The path to a CSV or Parquet file with consumption, interval_start and interval_end columns. The column names of the Octopus dashboard export are recognised.
+        mpan_or_mprn: The meter point to load the file into. Can be left out when the account has a single meter.
+        serial_number: The serial number of the meter to load the file into.
+        columns: A dictionary mapping the file's column names to consumption, interval_start and interval_end.
+
+    Returns:
+        None
+        
+    """
+
+    meters = [x for x in self.CONSUMPTION if (mpan_or_mprn is None or x['mpan_or_mprn'] == mpan_or_mprn) and (serial_number is None or x['serial_number'] == serial_number)]
+    if len(meters) != 1:
+        available = ', '.join(f"{x['mpan_or_mprn']} {x['serial_number']}" for x in self.CONSUMPTION)
+        raise ValueError(f'Choose the meter to import into with mpan_or_mprn and serial_number. The account has: {available}')
+
+    meter = {'account_id': self.ACCOUNT_ID, 'mpan_or_mprn': meters[0]['mpan_or_mprn'], 'serial_number': meters[0]['serial_number']}
+    table_name = '_'.join(meter.values())
+
+    if self.partitioned_consumption:
+        create_partitioned_consumption_db(self.psql_pool)
+    else:
+        create_consumption_db(self.psql_pool, table_name)
+
+    print(f'Importing consumption data for {meter['serial_number']} at {meter['mpan_or_mprn']} meter point from {path}.')
+
+    rows = 0
+    for batch in read_consumption_batches(path, columns):
+        if self.partitioned_consumption:
+            insert_partitioned_consumption(self.psql_pool, batch, meter)
+        else:
+            insert_consumption(self.psql_pool, batch, table_name)
+        rows += len(batch)
+
+    insert_updates(self.psql_pool, table_name + IMPORT_UPDATES_SUFFIX)
+
+    print(f'Imported {rows} rows.')
+
+
+def _update_tariffs(self, tariff_codes, force_refresh=None, incremental=False, period_from=None, period_to=None, workers=None, updates=None, coverage=None):
+
+    """
+    Update the tariffs, skipping those whose stored rates are still fresh. updates and coverage are loaded when they are not passed on from update().
+    """
+
+    if updates is None:
+        updates = query_all_updates(self.psql_pool)
+    if coverage is None:
+        coverage = query_rates_coverage(self.psql_pool, self.unified_rates)
+
+    _create_shared_tables(self)
+
+    _run_tasks([
+        partial(
+            self._get_tariffs,
+            self.psql_pool,
+            entry["tariff_code"],
+            force_refresh=force_refresh,
+            session=self.session,
+            unified=self.unified_rates,
+            incremental=incremental,
+            period_from=period_from,
+            period_to=period_to,
+            updates=updates,
+            coverage=coverage,
+        )
+        for entry in tariff_codes
+    ], workers)
+
+
+def _create_shared_tables(self):
+
+    """
+    Create the tables that tasks running at the same time all write to before they start, as concurrent CREATE TABLE statements for the same table can collide in PostgresQL.
+    """
+
+    if self.partitioned_consumption:
+        create_partitioned_consumption_db(self.psql_pool)
+
+    if self.unified_rates:
+        create_tariff_rates_db(self.psql_pool)
+
+
+def _run_tasks(tasks, workers=None):
+
+    """
+    Run the tasks one after another or, with more than one worker, in a thread pool. The first error raised by a task is raised again once all of them have finished.
+    """
+
+    if not workers or workers <= 1:
+        for task in tasks:
+            task()
+        return
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(task) for task in tasks]
+
+    for future in futures:
+        future.result()
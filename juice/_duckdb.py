@@ -0,0 +1,359 @@
+from contextlib import contextmanager
+from itertools import islice
+import threading
+import pandas as pd
+from psycopg.sql import Composed, Identifier, Literal
+
+from ._data import (
+    EMBEDDED_TIMESTAMP_COLUMNS,
+    EMBEDDED_BATCH_SIZE,
+    PRODUCT_TARIFFS_TABLE,
+)
+
+
+class EmbeddedStore:
+    """
+    An in-process DuckDB database used in place of a PostgresQL server.
+
+    The helpers in juice._psql route calls made with an EmbeddedStore to the functions of the same name in this module.
+    """
+
+    def __init__(self, path):
+        try:
+            import duckdb
+        except ImportError:
+            raise ImportError(
+                "The embedded storage backend requires DuckDB. Install it with: pip install duckdb"
+            )
+
+        self.path = path
+        self.connection = duckdb.connect(path)
+        self.errors = duckdb
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def cursor(self):
+        # every caller gets its own cursor so the store can be shared between threads
+        with self.lock:
+            curr = self.connection.cursor()
+        try:
+            yield curr
+        finally:
+            curr.close()
+
+    def close(self):
+        self.connection.close()
+
+
+def create_embedded_store(path):
+    return EmbeddedStore(path)
+
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _replace_rows(store, rows, table_name, columns, key_columns):
+    """
+    Upsert rows into table_name through a registered DataFrame. Stored rows sharing key_columns with the new ones are deleted before the new ones are inserted, which also matches NULL keys.
+    """
+
+    df = pd.DataFrame(list(rows), columns=columns)
+    if df.empty:
+        return
+
+    for column in columns:
+        if column in EMBEDDED_TIMESTAMP_COLUMNS:
+            df[column] = pd.to_datetime(df[column], utc=True, format="ISO8601")
+
+    df = df.drop_duplicates(key_columns, keep="last")
+
+    table = _quote(table_name)
+    names = ", ".join(_quote(n) for n in columns)
+    matches = " and ".join(
+        f"{table}.{_quote(n)} is not distinct from juice_staging.{_quote(n)}"
+        for n in key_columns
+    )
+
+    with store.cursor() as curr:
+        curr.register("juice_staging", df)
+        try:
+            curr.execute("BEGIN TRANSACTION")
+            curr.execute(
+                f"DELETE FROM {table} WHERE EXISTS (SELECT 1 FROM juice_staging WHERE {matches})"
+            )
+            curr.execute(
+                f"INSERT INTO {table} ({names}) SELECT {names} FROM juice_staging"
+            )
+            curr.execute("COMMIT")
+        except Exception:
+            curr.execute("ROLLBACK")
+            raise
+        finally:
+            curr.unregister("juice_staging")
+
+
+def _render(query):
+    """
+    Return a psycopg composed query as DuckDB SQL and its parameters. Identifiers are quoted here and literals are bound as parameters, so no PostgresQL connection is needed to render them.
+    """
+
+    if isinstance(query, Composed):
+        parts = [_render(part) for part in query]
+        return "".join(sql for sql, _ in parts), [
+            v for _, values in parts for v in values
+        ]
+    if isinstance(query, Identifier):
+        return ".".join(_quote(name) for name in query._obj), []
+    if isinstance(query, Literal):
+        return "?", [query._obj]
+    return query.as_string(None), []
+
+
+def retrive(store, query, params=None):
+
+    if not isinstance(query, str):
+        query, values = _render(query)
+        params = values + list(params or [])
+
+    with store.cursor() as curr:
+        try:
+            curr.execute(query, params)
+        except store.errors.CatalogException:
+            raise ValueError
+
+        return curr.fetchall()
+
+
+def count(store, table_name):
+    return retrive(store, f"select count(*) from {_quote(table_name)}")[0][0]
+
+
+def query_existing_tables(store, table_names):
+
+    return {
+        x[0]
+        for x in retrive(
+            store,
+            "select table_name from information_schema.tables where list_contains(?, table_name)",
+            [list(table_names)],
+        )
+    }
+
+
+def drop_table(store, table_name):
+
+    with store.cursor() as curr:
+        curr.execute(f"drop table if exists {_quote(table_name)}")
+
+
+def _create_table(store, table_name, columns):
+
+    with store.cursor() as curr:
+        curr.execute(f"CREATE TABLE IF NOT EXISTS {_quote(table_name)} ({columns})")
+
+
+def create_updates_table(store, table_name="updates"):
+
+    _create_table(
+        store, table_name, "name varchar primary key, updated timestamptz not null"
+    )
+
+
+def insert_updates(store, updated_table_name, table_name="updates"):
+
+    with store.cursor() as curr:
+        curr.execute(
+            f"INSERT INTO {_quote(table_name)} (name, updated) VALUES (?, CURRENT_TIMESTAMP) \
+                ON CONFLICT (name) DO UPDATE SET updated = EXCLUDED.updated",
+            [updated_table_name],
+        )
+
+
+def create_octopus_products_db(store, table_name="products_octopus_energy"):
+
+    _create_table(
+        store,
+        table_name,
+        """
+        code varchar primary key,
+        full_name varchar not null,
+        display_name varchar not null,
+        description varchar not null,
+        is_variable bool not null,
+        is_green bool not null,
+        is_tracker bool not null,
+        is_prepay bool not null,
+        is_business bool not null,
+        is_restricted bool not null,
+        term smallint,
+        available_from timestamptz not null,
+        available_to timestamptz,
+        added timestamptz default CURRENT_TIMESTAMP,
+        updated timestamptz default CURRENT_TIMESTAMP,
+        brand varchar not null
+        """,
+    )
+
+
+def insert_octopus_energy_products(store, data, table_name="products_octopus_energy"):
+
+    columns = [
+        "code",
+        "full_name",
+        "display_name",
+        "description",
+        "is_variable",
+        "is_green",
+        "is_tracker",
+        "is_prepay",
+        "is_business",
+        "is_restricted",
+        "term",
+        "available_from",
+        "available_to",
+        "brand",
+    ]
+
+    _replace_rows(
+        store,
+        ([row[n] for n in columns] for row in data),
+        table_name,
+        columns,
+        ["code"],
+    )
+
+
+def create_product_tariffs_db(store, table_name=PRODUCT_TARIFFS_TABLE):
+
+    _create_table(
+        store,
+        table_name,
+        """
+        product_code varchar not null,
+        energy_type varchar not null,
+        region varchar not null,
+        payment_method varchar not null,
+        tariff_code varchar not null,
+        unique (product_code, energy_type, region, payment_method)
+        """,
+    )
+
+
+def insert_product_tariffs(store, products, table_name=PRODUCT_TARIFFS_TABLE):
+
+    from ._psql import PRODUCT_TARIFF_COLUMNS, _product_tariff_rows
+
+    _replace_rows(
+        store,
+        (
+            [row[n] for n in PRODUCT_TARIFF_COLUMNS]
+            for row in _product_tariff_rows(products)
+        ),
+        table_name,
+        PRODUCT_TARIFF_COLUMNS,
+        ["product_code", "energy_type", "region", "payment_method"],
+    )
+
+
+def create_calorific_value_db(store, table_name="calorific_values"):
+
+    _create_table(
+        store,
+        table_name,
+        "applicable_date timestamptz not null, exit_zone varchar not null, calorific_value double not null",
+    )
+
+
+def insert_calorific(store, results, table_name="calorific_values"):
+
+    from ._psql import _calorific_rows
+
+    columns = ["applicable_date", "exit_zone", "calorific_value"]
+    rows = ([row[n] for n in columns] for row in _calorific_rows(results))
+
+    # loaded in batches so a long streamed download is never held in memory at once
+    while batch := list(islice(rows, EMBEDDED_BATCH_SIZE)):
+        for row in batch:
+            row[2] = float(row[2])
+
+        _replace_rows(
+            store, batch, table_name, columns, ["applicable_date", "exit_zone"]
+        )
+
+
+def query_missing_calorific(store, date, ldz, table_name="calorific_values"):
+
+    query = f"SELECT generate_series FROM generate_series(CAST(? AS TIMESTAMPTZ), CAST(CURRENT_DATE AS TIMESTAMPTZ), interval '1 day') \
+        WHERE generate_series NOT IN (SELECT applicable_date FROM {_quote(table_name)} where exit_zone = ?) ORDER BY 1 LIMIT 1"
+
+    try:
+        return retrive(store, query, [date, ldz])[0][0]
+    except IndexError:
+        return None
+    except ValueError:
+        return date
+
+
+def create_ldz_table(store, table_name="LDZ"):
+
+    _create_table(store, table_name, "postcode varchar not null, LDZ varchar not null")
+
+
+def insert_ldz(store, table_name="LDZ"):
+
+    from .utils import _ldz_rows
+
+    rows = _ldz_rows()
+    while batch := list(islice(rows, EMBEDDED_BATCH_SIZE)):
+        _replace_rows(store, batch, table_name, ["postcode", "LDZ"], ["postcode"])
+
+
+def create_consumption_db(store, table_name="consumption"):
+
+    _create_table(
+        store,
+        table_name,
+        "consumption double not null, interval_start timestamptz not null, interval_end timestamptz not null",
+    )
+
+
+def insert_consumption(store, results, table_name="consumption"):
+
+    columns = ["consumption", "interval_start", "interval_end"]
+
+    _replace_rows(
+        store,
+        ([item[n] for n in columns] for item in results),
+        table_name,
+        columns,
+        ["interval_start", "interval_end"],
+    )
+
+
+def create_unit_rates_db(store, table_name="unit_rates"):
+
+    _create_table(
+        store,
+        table_name,
+        "value_inc_vat double not null, value_exc_vat double not null, valid_from timestamptz, valid_to timestamptz, payment_method varchar",
+    )
+
+
+def insert_unit_rates(store, results, table_name="unit_rates"):
+
+    columns = [
+        "value_inc_vat",
+        "value_exc_vat",
+        "valid_from",
+        "valid_to",
+        "payment_method",
+    ]
+
+    _replace_rows(
+        store,
+        ([item[n] for n in columns] for item in results),
+        table_name,
+        columns,
+        ["valid_from", "payment_method"],
+    )
@@ -1,12 +1,17 @@
-import random
-import time
 import requests
 from requests.auth import HTTPBasicAuth
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from itertools import islice
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
 import csv
+import math
 from datetime import datetime, timedelta, UTC
 
 from ._psql import (
     create_octopus_products_db,
+    create_product_tariffs_db,
+    insert_product_tariffs,
     create_unit_rates_db,
     create_consumption_db,
     drop_table,
@@ -19,8 +24,31 @@ from ._psql import (
     insert_calorific,
     insert_updates,
     query_updates,
+    create_partitioned_consumption_db,
+    insert_partitioned_consumption,
+    count_partitioned_consumption,
+    delete_partitioned_consumption,
+    create_tariff_rates_db,
+    insert_tariff_rates,
+    count_tariff_rates,
+    delete_tariff_rates,
+    query_latest_interval_end,
+    query_latest_interval_start,
+    query_consumption_gaps,
+    query_latest_valid_from,
+    query_product_availability,
 )
-from ._data import OCOTPUS_API_BASE_URL, PAGE_SIZE, UPDATE_INTERVAL
+from ._data import (
+    OCOTPUS_API_BASE_URL,
+    PAGE_SIZE,
+    FRESHNESS,
+    DAY_AHEAD_LEAD,
+    PARTITIONED_CONSUMPTION_TABLE,
+    TARIFF_RATES_TABLE,
+    WINDOW_UPDATES_SUFFIX,
+)
+
+NEVER_UPDATED = datetime(1900, 1, 1, 0, 0, 0, 0, UTC)
 
 CONSUMPTION_URL = (
     OCOTPUS_API_BASE_URL
@@ -33,32 +61,92 @@ TARIFFS_URL = (
 
 
 @staticmethod
-def _get_octopus_products(psql_config, headers=None):
+def _get_octopus_products(psql_config, session=None, updates=None):
     table_name = "products_octopus_energy"
 
-    if datetime.now(UTC) < query_updates(psql_config, table_name) + timedelta(
-        hours=UPDATE_INTERVAL
-    ):
+    if _is_fresh(psql_config, table_name, "products", updates):
         print("Skipping recently updated Octopus Products database.")
         return
     else:
         print("Updating Octopus Products database.")
 
-    url = OCOTPUS_API_BASE_URL + "/products"
+    url = OCOTPUS_API_BASE_URL + f"/products?page_size={_page_size(session)}"
 
-    r = requests.get(url, headers=headers)
+    data = [product for page in _get_pages(url, session) for product in page["results"]]
+
+    # the regional tariffs of a product only change with its availability, so only new and changed products are looked up
+    stored = query_product_availability(psql_config, table_name)
+    changed = {
+        product["code"]
+        for product in data
+        if stored.get(product["code"]) != _availability(product)
+    }
 
-    data = r.json()["results"]
+    print(f"Getting the regional tariffs of {len(changed)} Octopus Products.")
+
+    details = _get_product_details(sorted(changed), session)
+
+    # products whose details failed are stored next time, so they are looked up again
+    found = {product["code"] for product in details}
+    data = [
+        product
+        for product in data
+        if product["code"] in found or product["code"] not in changed
+    ]
 
     create_octopus_products_db(psql_config, table_name)
     insert_octopus_energy_products(psql_config, data, table_name)
 
-    insert_updates(psql_config, table_name)
+    create_product_tariffs_db(psql_config)
+    insert_product_tariffs(psql_config, details)
+
+    _mark_updated(psql_config, table_name, updates)
 
     pass
 
 
-def _octopus_custom_products_download(psql_config, products, headers=None):
+def _availability(product):
+    return tuple(
+        datetime.fromisoformat(product[key]) if product[key] else None
+        for key in ["available_from", "available_to"]
+    )
+
+
+def _get_product_detail(session, code):
+    url = OCOTPUS_API_BASE_URL + f"/products/{code}/"
+
+    try:
+        response = _session(session).get(url)
+        product = response.json()
+    except (requests.RequestException, ValueError) as e:
+        print(f"Skipping the regional tariffs of {code}: {e}")
+        return None
+
+    if response.status_code != 200 or "code" not in product:
+        print(
+            f"Skipping the regional tariffs of {code}, the API responded with {response.status_code}."
+        )
+        return None
+
+    return product
+
+
+def _get_product_details(product_codes, session=None):
+    """
+    Return the detail pages of the products, downloaded by the session's page_workers at the same time. Products that were not found or failed to download are left out.
+    """
+
+    workers = max(getattr(session, "page_workers", 1), 1)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        details = list(
+            executor.map(lambda code: _get_product_detail(session, code), product_codes)
+        )
+
+    return [product for product in details if product]
+
+
+def _octopus_custom_products_download(psql_config, products, session=None):
     print("Updating Octopus Products database")
     create_octopus_products_db(psql_config)
     url = "https://api.octopus.energy/v1/products/{product}/"
@@ -69,7 +157,7 @@ def _octopus_custom_products_download(psql_config, products, headers=None):
 
         product_url = url.format(product=product)
 
-        r = requests.get(product_url, headers=headers)
+        r = _session(session).get(product_url)
         data = r.json()
 
         if len(data.keys()) == 1:
@@ -78,46 +166,61 @@ def _octopus_custom_products_download(psql_config, products, headers=None):
 
         insert_octopus_energy_products(psql_config, [data])
 
-        time.sleep(random.random())
+        create_product_tariffs_db(psql_config)
+        insert_product_tariffs(psql_config, [data])
+
+
+PUB_ID_LOOKUP = {
+    "Campbeltown": "PUBOBJ1660",
+    "EA": "PUBOB4507",
+    "EM": "PUBOB4508",
+    "NE": "PUBOB4510",
+    "NO": "PUBOB4509",
+    "NT": "PUBOB4511",
+    "NW": "PUBOB4512",
+    "SC": "PUBOB4513",
+    "SE": "PUBOB4514",
+    "SO": "PUBOB4515",
+    "SW": "PUBOB4516",
+    "WM": "PUBOB4517",
+    "WN": "PUBOB4518",
+    "WS": "PUBOB4519",
+    "Oban": "PUBOB4521",
+    "Stornoway": "PUBOB4520",
+    "Stranraer": "PUBOB4522",
+    "Thurso": "PUBOBJ1661",
+    "Wick": "PUBOBJ1662",
+}
 
 
 @staticmethod
 def _get_calorific_values(
-    psql_config, moved_in_at, LDZ, force_refresh=False, headers=None
+    psql_config, moved_in_at, LDZ, force_refresh=False, session=None, updates=None
 ):
+    """
+    Download the calorific values of one LDZ or a list of them, e.g. list(PUB_ID_LOOKUP), in a single request. The CSV is streamed into the database so memory use does not grow with the length of the history.
+    """
 
     table_name = "calorific_values"
-    update_name = table_name + "_" + LDZ
 
-    if not force_refresh and datetime.now(UTC) < query_updates(
-        psql_config, update_name
-    ) + timedelta(hours=UPDATE_INTERVAL):
-        print(f"Skipping recently updated calorific values for {LDZ} LDZ.")
-        return
+    if isinstance(LDZ, str):
+        LDZ = [LDZ]
 
-    PUB_ID_LOOKUP = {
-        "Campbeltown": "PUBOBJ1660",
-        "EA": "PUBOB4507",
-        "EM": "PUBOB4508",
-        "NE": "PUBOB4510",
-        "NO": "PUBOB4509",
-        "NT": "PUBOB4511",
-        "NW": "PUBOB4512",
-        "SC": "PUBOB4513",
-        "SE": "PUBOB4514",
-        "SO": "PUBOB4515",
-        "SW": "PUBOB4516",
-        "WM": "PUBOB4517",
-        "WN": "PUBOB4518",
-        "WS": "PUBOB4519",
-        "Oban": "PUBOB4521",
-        "Stornoway": "PUBOB4520",
-        "Stranraer": "PUBOB4522",
-        "Thurso": "PUBOBJ1661",
-        "Wick": "PUBOBJ1662",
-    }
+    if not force_refresh:
+        stale = []
+        for ldz in LDZ:
+            if _is_fresh(
+                psql_config, table_name + "_" + ldz, "calorific_values", updates
+            ):
+                print(f"Skipping recently updated calorific values for {ldz} LDZ.")
+            else:
+                stale.append(ldz)
+        LDZ = stale
 
-    pub_id = PUB_ID_LOOKUP[LDZ]
+    if not LDZ:
+        return
+
+    pub_ids = ",".join(PUB_ID_LOOKUP[ldz] for ldz in LDZ)
     national_gas_api = "https://data.nationalgas.com/api/find-gas-data-download?applicableFor=Y&dateFrom={from_date}&dateTo={to_date}&dateType=GASDAY&latestFlag=Y&ids={pub_ids}&type=CSV"
 
     if force_refresh:
@@ -127,27 +230,33 @@ def _get_calorific_values(
 
     moved_in_at = datetime.fromisoformat(moved_in_at).strftime("%Y-%m-%d")
 
-    earliest_date = query_missing_calorific(psql_config, moved_in_at, LDZ)
+    # one request covers every LDZ so it starts from the earliest missing date of any of them
+    missing = [query_missing_calorific(psql_config, moved_in_at, ldz) for ldz in LDZ]
+    missing = [date for date in missing if date]
 
     tomorrow = datetime.now() + timedelta(days=1)
     to_date = datetime.strftime(tomorrow, "%Y-%m-%d")
 
-    if earliest_date:
-        from_date = earliest_date.strftime("%Y-%m-%d")
+    if missing:
+        from_date = min(missing).strftime("%Y-%m-%d")
     else:
         week_ago = datetime.now() - timedelta(days=7)
         from_date = datetime.strftime(week_ago, "%Y-%m-%d")
 
-    url = national_gas_api.format(from_date=from_date, to_date=to_date, pub_ids=pub_id)
+    url = national_gas_api.format(from_date=from_date, to_date=to_date, pub_ids=pub_ids)
 
-    print(f"Getting calorific values for {LDZ} LDZ from {from_date}.")
+    print(f"Getting calorific values for {', '.join(LDZ)} LDZ from {from_date}.")
 
-    with requests.get(url, stream=True, headers=headers) as r:
+    with _session(session).get(url, stream=True) as r:
         lines = (line.decode("utf-8") for line in r.iter_lines())
-        data = list(csv.reader(lines))[1:]
+        rows = csv.reader(lines)
+        # skip the header
+        next(rows, None)
 
-    insert_calorific(psql_config, data)
-    insert_updates(psql_config, update_name)
+        insert_calorific(psql_config, (row for row in rows if len(row) > 3))
+
+    for ldz in LDZ:
+        _mark_updated(psql_config, table_name + "_" + ldz, updates)
 
 
 @staticmethod
@@ -159,10 +268,19 @@ def _get_consumption(
     serial_number,
     account_id,
     force_refresh=False,
-    headers=None,
+    session=None,
+    partitioned=False,
+    incremental=False,
+    updates=None,
+    group_by=None,
 ):
 
     table_name = account_id + "_" + mpan_or_mprn + "_" + serial_number
+    meter = {
+        "account_id": account_id,
+        "mpan_or_mprn": mpan_or_mprn,
+        "serial_number": serial_number,
+    }
 
     url = (
         CONSUMPTION_URL.format(
@@ -170,12 +288,16 @@ def _get_consumption(
             mpan_or_mprn=mpan_or_mprn,
             serial_number=serial_number,
         )
-        + f"?page_size={PAGE_SIZE}"
+        + f"?page_size={_page_size(session)}"
     )
 
-    if not force_refresh and datetime.now(UTC) < query_updates(
-        psql_config, table_name
-    ) + timedelta(hours=UPDATE_INTERVAL):
+    if group_by:
+        # daily or hourly totals are kept in a per meter table of their own, e.g. A-1234_1200000000000_21L0000000_day
+        table_name += "_" + group_by
+        partitioned = False
+        url += f"&group_by={group_by}"
+
+    if not force_refresh and _is_fresh(psql_config, table_name, "consumption", updates):
         print(
             f"Skipping recently updated consumption data for {serial_number} at {mpan_or_mprn} meter point for account {account_id}."
         )
@@ -185,36 +307,247 @@ def _get_consumption(
             f"Getting consumption data for {serial_number} at {mpan_or_mprn} meter point for account {account_id}."
         )
 
-    if force_refresh:
-        drop_table(psql_config, table_name)
+    if partitioned:
+        if force_refresh:
+            delete_partitioned_consumption(psql_config, meter)
 
-    create_consumption_db(psql_config, table_name)
+        create_partitioned_consumption_db(psql_config)
+    else:
+        if force_refresh:
+            drop_table(psql_config, table_name)
 
-    while True:
-        r = requests.get(url, auth=HTTPBasicAuth(api_key, ""), headers=headers)
-        data = r.json()
+        create_consumption_db(psql_config, table_name)
 
-        curr_count = count(psql_config, table_name)
+    if incremental:
+        if partitioned:
+            latest = query_latest_interval_end(
+                psql_config, PARTITIONED_CONSUMPTION_TABLE, meter
+            )
+        elif group_by:
+            # the latest day or hour may have been stored before it was complete, so it is asked for again and replaced
+            latest = query_latest_interval_start(psql_config, table_name)
+        else:
+            latest = query_latest_interval_end(psql_config, table_name)
+
+        # only ask for the intervals after the newest one stored, the whole history is fetched for a new meter
+        if latest:
+            url += f"&period_from={_format_period(latest)}"
+
+    # pages are followed one at a time when the sync stops once the stored rows match the count
+    for data in _get_pages(
+        url, session, prefetch=incremental, auth=HTTPBasicAuth(api_key, "")
+    ):
         total_count = data["count"]
         results = data["results"]
 
-        if total_count == curr_count:
-            break
+        if not incremental:
+            if partitioned:
+                curr_count = count_partitioned_consumption(psql_config, meter)
+            else:
+                curr_count = count(psql_config, table_name)
 
-        insert_consumption(psql_config, results, table_name)
+            if total_count == curr_count:
+                break
 
-        if data["next"]:
-            url = data["next"]
+        if partitioned:
+            insert_partitioned_consumption(psql_config, results, meter)
         else:
-            break
+            insert_consumption(psql_config, results, table_name)
+
+    _mark_updated(psql_config, table_name, updates)
+
+
+@staticmethod
+def _backfill_consumption(
+    psql_config,
+    api_key,
+    energy_type,
+    mpan_or_mprn,
+    serial_number,
+    account_id,
+    session=None,
+    partitioned=False,
+):
+
+    table_name = account_id + "_" + mpan_or_mprn + "_" + serial_number
+    meter = {
+        "account_id": account_id,
+        "mpan_or_mprn": mpan_or_mprn,
+        "serial_number": serial_number,
+    }
+
+    if partitioned:
+        gaps = query_consumption_gaps(psql_config, PARTITIONED_CONSUMPTION_TABLE, meter)
+    else:
+        gaps = query_consumption_gaps(psql_config, table_name)
+
+    if not gaps:
+        print(
+            f"No gaps found in the consumption data for {serial_number} at {mpan_or_mprn} meter point for account {account_id}."
+        )
+        return
+
+    inserted = False
+    for gap_start, gap_end in gaps:
+        print(
+            f"Backfilling consumption data for {serial_number} at {mpan_or_mprn} meter point from {gap_start} to {gap_end}."
+        )
+
+        url = (
+            CONSUMPTION_URL.format(
+                energy_type=energy_type,
+                mpan_or_mprn=mpan_or_mprn,
+                serial_number=serial_number,
+            )
+            + f"?page_size={_page_size(session)}&period_from={_format_period(gap_start)}&period_to={_format_period(gap_end)}"
+        )
+
+        for data in _get_pages(url, session, auth=HTTPBasicAuth(api_key, "")):
+            if not data["results"]:
+                continue
+
+            if partitioned:
+                insert_partitioned_consumption(psql_config, data["results"], meter)
+            else:
+                insert_consumption(psql_config, data["results"], table_name)
+            inserted = True
+
+    # calculations and rollups built on the consumption before the backfill are invalidated through the updates table
+    if inserted:
+        _mark_updated(psql_config, table_name)
+
+
+def _session(session):
+    # module level requests is used when no session was supplied
+    if session is None:
+        return requests
+    return session
+
+
+def _format_period(date):
+    return date.astimezone(UTC).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def _last_updated(psql_config, name, updates=None):
+    # updates is the updates table loaded by query_all_updates, it is queried when missing
+    if updates is None:
+        return query_updates(psql_config, name)
+    return updates.get(name, NEVER_UPDATED)
+
+
+def _is_fresh(psql_config, name, policy, updates=None):
+    """
+    Whether the source called name was updated within the hours of its FRESHNESS policy.
+    """
+
+    updated = _last_updated(psql_config, name, updates)
+
+    return datetime.now(UTC) < updated + timedelta(hours=FRESHNESS[policy])
+
+
+def _mark_updated(psql_config, name, updates=None):
+    insert_updates(psql_config, name)
+
+    # keeps a loaded updates table current for the rest of the update run
+    if updates is not None:
+        updates[name] = datetime.now(UTC)
+
+
+def _rates_policy(coverage, cost_type, updated):
+    """
+    Return the FRESHNESS policy of a rates source from the latest valid_to of its stored rates and whether any are open ended, or None when the stored rates reach past the next day-ahead publication.
+
+    Rates that had all ended a day before the source was last updated belong to a withdrawn tariff and are treated as historic.
+    """
+
+    if not coverage or coverage[0] is None or coverage[1]:
+        return cost_type
+
+    latest = coverage[0]
+    if latest > datetime.now(UTC) + timedelta(hours=DAY_AHEAD_LEAD):
+        return None
+    if latest + timedelta(days=1) <= updated:
+        return "historic_rates"
+
+    return cost_type
+
+
+def _page_size(session):
+    return getattr(session, "page_size", PAGE_SIZE)
+
+
+def _get_page(session, url, kwargs):
+    return _session(session).get(url, **kwargs).json()
+
 
-        time.sleep(random.random())
+def _page_url(next_url, page):
+    # the next link of the first page with its page number changed, so the other parameters are the API's own
+    parts = urlsplit(next_url)
+    query = [(k, v) for k, v in parse_qsl(parts.query) if k != "page"]
+    return urlunsplit(parts._replace(query=urlencode(query + [("page", page)])))
 
-    insert_updates(psql_config, table_name)
+
+def _get_pages(url, session=None, prefetch=True, **kwargs):
+    """
+    Yield the pages of a paginated endpoint in order, ending with the first page that has no next link.
+
+    With prefetch, the count in the first page gives the number of pages so up to the session's page_workers of them are downloaded at the same time instead of following next one page after another. Pages past that count are still followed through next. Callers that usually stop after a few pages, e.g. once the stored rows match the count, turn prefetch off so no page is downloaded only to be thrown away.
+    """
+
+    data = _get_page(session, url, kwargs)
+    yield data
+
+    if not data["results"] or not data.get("next"):
+        return
+
+    workers = getattr(session, "page_workers", 1)
+
+    if prefetch and workers > 1:
+        pages = math.ceil(data["count"] / len(data["results"]))
+        urls = (_page_url(data["next"], page) for page in range(2, pages + 1))
+
+        # at most page_workers pages are in flight or waiting to be yielded, the next one is requested as each is handed over
+        executor = ThreadPoolExecutor(max_workers=workers)
+        futures = deque(
+            executor.submit(_get_page, session, page_url, kwargs)
+            for page_url in islice(urls, workers)
+        )
+        try:
+            while futures:
+                data = futures.popleft().result()
+                yield data
+
+                # the count can change during a sync, the pages are trusted over it
+                if not data["results"] or not data.get("next"):
+                    return
+
+                for page_url in islice(urls, 1):
+                    futures.append(
+                        executor.submit(_get_page, session, page_url, kwargs)
+                    )
+        finally:
+            # pages that are no longer needed are not downloaded when the caller stops early
+            executor.shutdown(cancel_futures=True)
+
+    while data["results"] and data.get("next"):
+        data = _get_page(session, data["next"], kwargs)
+        yield data
 
 
 @staticmethod
-def _get_tariffs(psql_config, tariff_code, force_refresh=False, headers=None):
+def _get_tariffs(
+    psql_config,
+    tariff_code,
+    force_refresh=False,
+    session=None,
+    unified=False,
+    incremental=False,
+    period_from=None,
+    period_to=None,
+    updates=None,
+    coverage=None,
+    cost_types=None,
+):
 
     if "G-1R" in tariff_code:
         energy_type = "gas"
@@ -223,15 +556,32 @@ def _get_tariffs(psql_config, tariff_code, force_refresh=False, headers=None):
 
     for type in ["standard-unit-rates", "standing-charges"]:
 
-        table_name = tariff_code + "_" + type.replace("-", "_")
+        cost_type = type.replace("-", "_")
+        table_name = tariff_code + "_" + cost_type
 
-        if not force_refresh and datetime.now(UTC) < query_updates(
-            psql_config, table_name
-        ) + timedelta(hours=UPDATE_INTERVAL):
-            print(f"Skipping recently updated {tariff_code} {type.replace('-', ' ')}.")
-            return
-        else:
-            print(f"Getting {tariff_code} {type.replace('-', ' ')}.")
+        if cost_types and cost_type not in cost_types:
+            continue
+
+        # a requested window is always downloaded, whenever the rest of the tariff was updated
+        if not force_refresh and not (period_from or period_to):
+            policy = _rates_policy(
+                (coverage or {}).get(table_name),
+                cost_type,
+                _last_updated(psql_config, table_name, updates),
+            )
+
+            if policy is None:
+                print(
+                    f"Skipping {tariff_code} {type.replace('-', ' ')}, the stored rates already include the next publication."
+                )
+                continue
+            if _is_fresh(psql_config, table_name, policy, updates):
+                print(
+                    f"Skipping recently updated {tariff_code} {type.replace('-', ' ')}."
+                )
+                continue
+
+        print(f"Getting {tariff_code} {type.replace('-', ' ')}.")
 
         url = (
             TARIFFS_URL.format(
@@ -239,37 +589,68 @@ def _get_tariffs(psql_config, tariff_code, force_refresh=False, headers=None):
                 product_code=tariff_code[5:-2],
                 tariff_code=tariff_code,
             )
-            + f"/{type}?page_size={PAGE_SIZE}"
+            + f"/{type}?page_size={_page_size(session)}"
         )
 
-        if force_refresh:
-            drop_table(psql_config, table_name)
+        if unified:
+            if force_refresh:
+                delete_tariff_rates(psql_config, tariff_code, cost_type)
 
-        create_unit_rates_db(psql_config, table_name)
+            create_tariff_rates_db(psql_config)
+        else:
+            if force_refresh:
+                drop_table(psql_config, table_name)
 
-        while True:
-            r = requests.get(url, headers=headers)
-            data = r.json()
+            create_unit_rates_db(psql_config, table_name)
+
+        # a window limits the download to the dates a calculation needs
+        windowed = period_from or period_to
+        if windowed:
+            if period_from:
+                url += f"&period_from={_format_period(period_from)}"
+            if period_to:
+                url += f"&period_to={_format_period(period_to)}"
+        elif incremental:
+            if unified:
+                latest = query_latest_valid_from(
+                    psql_config, TARIFF_RATES_TABLE, tariff_code, cost_type
+                )
+            else:
+                latest = query_latest_valid_from(psql_config, table_name)
 
+            # the newest stored rate is asked for again so its valid_to is updated once it has been superseded
+            if latest:
+                url += f"&period_from={_format_period(latest)}"
+                windowed = True
+
+        for data in _get_pages(url, session, prefetch=windowed):
             try:
-                curr_count = count(psql_config, table_name)
                 total_count = data["count"]
                 results = data["results"]
             except KeyError:
                 print(f"There is no information available for {tariff_code}.")
-                drop_table(psql_config, table_name)
+                if unified:
+                    delete_tariff_rates(psql_config, tariff_code, cost_type)
+                else:
+                    drop_table(psql_config, table_name)
                 return
 
-            if total_count == curr_count:
-                break
+            if not windowed:
+                if unified:
+                    curr_count = count_tariff_rates(psql_config, tariff_code, cost_type)
+                else:
+                    curr_count = count(psql_config, table_name)
 
-            insert_unit_rates(psql_config, results, table_name)
+                if total_count == curr_count:
+                    break
 
-            if data["next"]:
-                url = data["next"]
+            if unified:
+                insert_tariff_rates(psql_config, results, tariff_code, cost_type)
             else:
-                break
+                insert_unit_rates(psql_config, results, table_name)
 
-            time.sleep(random.random())
-
-        insert_updates(psql_config, table_name)
+        # a requested window leaves the rest of the tariff as old as it was
+        if period_from or period_to:
+            _mark_updated(psql_config, table_name + WINDOW_UPDATES_SUFFIX, updates)
+        else:
+            _mark_updated(psql_config, table_name, updates)
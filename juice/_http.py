@@ -0,0 +1,283 @@
+import json
+import sqlite3
+import threading
+import time
+from datetime import datetime, UTC
+from urllib.parse import urlsplit, parse_qs
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from urllib3.util.retry import Retry
+
+from ._data import HTTP_CONFIG, MAX_PAGE_SIZE
+
+
+class RateLimiter:
+    """
+    A thread safe token bucket allowing rate requests per second with bursts of up to burst requests.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.burst, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                wait = (1 - self.tokens) / self.rate
+
+            time.sleep(wait)
+
+
+class ResponseCache:
+    """
+    A thread safe SQLite file of response bodies keyed by URL, holding at most max_size bytes. The least recently used responses are evicted first.
+    """
+
+    def __init__(self, path, max_size):
+        self.path = path
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+
+        with self.lock, self.connection:
+            self.connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS responses (
+                    url text primary key,
+                    etag text,
+                    last_modified text,
+                    headers text not null,
+                    body blob not null,
+                    immutable integer not null,
+                    size integer not null,
+                    accessed real not null
+                )"""
+            )
+
+    def get(self, url):
+
+        with self.lock, self.connection:
+            row = self.connection.execute(
+                "SELECT etag, last_modified, headers, body, immutable FROM responses WHERE url = ?",
+                (url,),
+            ).fetchone()
+
+            if row is None:
+                return None
+
+            self.connection.execute(
+                "UPDATE responses SET accessed = ? WHERE url = ?", (time.time(), url)
+            )
+
+        etag, last_modified, headers, body, immutable = row
+        return {
+            "etag": etag,
+            "last_modified": last_modified,
+            "headers": json.loads(headers),
+            "body": body,
+            "immutable": bool(immutable),
+        }
+
+    def set(self, url, response, immutable=False):
+
+        body = response.content
+        size = len(body)
+        if size > self.max_size:
+            return
+
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    url,
+                    response.headers.get("ETag"),
+                    response.headers.get("Last-Modified"),
+                    json.dumps(dict(response.headers)),
+                    body,
+                    int(immutable),
+                    size,
+                    time.time(),
+                ),
+            )
+            self._evict()
+
+    def _evict(self):
+
+        total = self.connection.execute(
+            "SELECT coalesce(sum(size), 0) FROM responses"
+        ).fetchone()[0]
+
+        if total <= self.max_size:
+            return
+
+        evicted = []
+        for url, size in self.connection.execute(
+            "SELECT url, size FROM responses ORDER BY accessed"
+        ).fetchall():
+            if total <= self.max_size:
+                break
+            evicted.append((url,))
+            total -= size
+
+        self.connection.executemany("DELETE FROM responses WHERE url = ?", evicted)
+
+    def close(self):
+        self.connection.close()
+
+
+class Session(requests.Session):
+    """
+    A keep-alive requests session that waits on a rate limiter before every request.
+
+    With a cache, unauthenticated GET requests are revalidated with If-None-Match and If-Modified-Since, and historic rate pages are answered from the cache without a request.
+    """
+
+    def __init__(self, limiter, page_size, page_workers, cache=None):
+        super().__init__()
+        self.limiter = limiter
+        self.page_size = page_size
+        self.page_workers = page_workers
+        self.cache = cache
+
+    def request(self, method, url, *args, **kwargs):
+
+        # account data and streamed downloads are never cached
+        cacheable = (
+            self.cache is not None
+            and method == "GET"
+            and not args
+            and not kwargs.get("params")
+            and not kwargs.get("auth")
+            and not kwargs.get("stream")
+        )
+
+        if not cacheable:
+            self.limiter.acquire()
+            return super().request(method, url, *args, **kwargs)
+
+        entry = self.cache.get(url)
+        if entry and entry["immutable"]:
+            return _cached_response(url, entry)
+
+        if entry:
+            headers = dict(kwargs.pop("headers", None) or {})
+            if entry["etag"]:
+                headers["If-None-Match"] = entry["etag"]
+            if entry["last_modified"]:
+                headers["If-Modified-Since"] = entry["last_modified"]
+            kwargs["headers"] = headers
+
+        self.limiter.acquire()
+        response = super().request(method, url, **kwargs)
+
+        if response.status_code == 304 and entry:
+            return _cached_response(url, entry)
+
+        if response.status_code == 200:
+            immutable = _is_historic(url, response)
+            if (
+                immutable
+                or "ETag" in response.headers
+                or "Last-Modified" in response.headers
+            ):
+                self.cache.set(url, response, immutable)
+
+        return response
+
+    def close(self):
+        super().close()
+        if self.cache is not None:
+            self.cache.close()
+
+
+def _cached_response(url, entry):
+
+    response = requests.Response()
+    response.status_code = 200
+    response.url = url
+    response.headers = CaseInsensitiveDict(entry["headers"])
+    response._content = entry["body"]
+    response._content_consumed = True
+    response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+    return response
+
+
+def _parse_date(date):
+    return datetime.fromisoformat(date.replace("Z", "+00:00"))
+
+
+def _is_historic(url, response):
+    """
+    Whether the response is a page of rates that can no longer change, i.e. it was requested with a period_to in the past and every rate on it has ended.
+    """
+
+    period_to = parse_qs(urlsplit(url).query).get("period_to")
+    now = datetime.now(UTC)
+
+    if not period_to or _parse_date(period_to[0]) > now:
+        return False
+
+    try:
+        results = response.json()["results"]
+    except (ValueError, KeyError, TypeError):
+        return False
+
+    return all(
+        rate.get("valid_to") and _parse_date(rate["valid_to"]) <= now
+        for rate in results
+    )
+
+
+def create_session(headers=None, http_config=None):
+    """
+    Return a session that reuses connections, retries transient errors and 429 responses with exponential backoff honouring Retry-After, rate limits requests and, when given a cache path, caches responses on disk.
+    """
+
+    settings = {**HTTP_CONFIG, **(http_config or {})}
+
+    retry = Retry(
+        total=settings["retries"],
+        backoff_factor=settings["backoff_factor"],
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=["GET"],
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        max_retries=retry,
+        pool_connections=settings["pool_connections"],
+        pool_maxsize=settings["pool_maxsize"],
+    )
+
+    if settings["cache"]:
+        cache = ResponseCache(settings["cache"], settings["cache_size"])
+    else:
+        cache = None
+
+    session = Session(
+        RateLimiter(settings["rate"], settings["burst"]),
+        min(settings["page_size"], MAX_PAGE_SIZE),
+        settings["page_workers"],
+        cache,
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+
+    if headers:
+        session.headers.update(headers)
+
+    return session
@@ -0,0 +1,83 @@
+import csv
+from itertools import islice
+
+from ._data import IMPORT_BATCH_SIZE
+
+CONSUMPTION_COLUMNS = ["consumption", "interval_start", "interval_end"]
+
+# headers of the Octopus dashboard consumption export
+COLUMN_ALIASES = {
+    "consumption (kwh)": "consumption",
+    "consumption (m3)": "consumption",
+    "start": "interval_start",
+    "end": "interval_end",
+}
+
+
+def _rename(names, columns=None):
+    """
+    Map the file's column names to the consumption columns using columns, the known aliases or the names themselves.
+    """
+
+    columns = columns or {}
+    renamed = {}
+    for name in names:
+        key = name.strip().lower()
+        target = columns.get(name) or COLUMN_ALIASES.get(key) or key
+        if target in CONSUMPTION_COLUMNS:
+            renamed[name] = target
+
+    missing = set(CONSUMPTION_COLUMNS) - set(renamed.values())
+    if missing:
+        raise ValueError(
+            f"The file has no {', '.join(sorted(missing))} column(s). Map its columns with the columns parameter, e.g. {{'Start': 'interval_start'}}."
+        )
+
+    return renamed
+
+
+def _read_csv_batches(path, columns=None, batch_size=IMPORT_BATCH_SIZE):
+
+    with open(path, newline="") as file:
+        reader = csv.DictReader(file)
+        renamed = _rename(reader.fieldnames or [], columns)
+
+        rows = (
+            {target: row[name] for name, target in renamed.items()} for row in reader
+        )
+        rows = (
+            {**row, "consumption": float(row["consumption"])}
+            for row in rows
+            if row["consumption"]
+        )
+
+        while batch := list(islice(rows, batch_size)):
+            yield batch
+
+
+def _read_parquet_batches(path, columns=None, batch_size=IMPORT_BATCH_SIZE):
+
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError(
+            "Importing Parquet files requires pyarrow. Install it with: pip install pyarrow"
+        )
+
+    parquet = pq.ParquetFile(path)
+    renamed = _rename(parquet.schema_arrow.names, columns)
+
+    for batch in parquet.iter_batches(batch_size=batch_size, columns=list(renamed)):
+        batch = batch.rename_columns([renamed[name] for name in batch.schema.names])
+        yield batch.to_pylist()
+
+
+def read_consumption_batches(path, columns=None, batch_size=IMPORT_BATCH_SIZE):
+    """
+    Yield lists of consumption rows read from a CSV or Parquet file, so a file of any size is loaded with bounded memory.
+    """
+
+    if str(path).lower().endswith((".parquet", ".pq")):
+        return _read_parquet_batches(path, columns, batch_size)
+
+    return _read_csv_batches(path, columns, batch_size)
@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+
+
+def interval_join(rates, dataframe, columns=("rate",)):
+    """
+    Pair every row of dataframe with each rate whose valid_from to valid_to interval overlaps the row's from to to interval. The result holds the same rows as a conditional join on valid_to > from and valid_from < to, with the rate columns first and the rows in the order of dataframe.
+
+    The rates are sorted by valid_from and looked up with np.searchsorted. A running maximum of valid_to bounds the lookup when rates overlap and a missing valid_to is open ended.
+    """
+
+    rates = rates.assign(
+        valid_from=rates["valid_from"].fillna(pd.Timestamp.min),
+        valid_to=rates["valid_to"].fillna(pd.Timestamp.max),
+    ).sort_values("valid_from", kind="stable")
+
+    starts = dataframe["from"].to_numpy()
+    ends = dataframe["to"].to_numpy()
+    valid_from = rates["valid_from"].to_numpy(dtype=starts.dtype)
+    valid_to = rates["valid_to"].to_numpy(dtype=starts.dtype)
+
+    # rates before first have all ended by the time the row starts and rates from last onwards begin after it ends
+    first = np.searchsorted(np.maximum.accumulate(valid_to), starts, side="right")
+    last = np.searchsorted(valid_from, ends, side="left")
+    counts = np.maximum(last - first, 0)
+
+    if (counts == 1).all() and (valid_to[first] > starts).all():
+        # the usual case of every row falling within a single rate
+        joined = dataframe.reset_index(drop=True)
+        for column in reversed(columns):
+            joined.insert(0, column, rates[column].to_numpy()[first])
+        return joined
+
+    rows = np.repeat(np.arange(len(dataframe)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    matched = np.repeat(first, counts) + offsets
+
+    # overlapping rates can leave rates that ended before the row started inside the range
+    keep = valid_to[matched] > starts[rows]
+    rows, matched = rows[keep], matched[keep]
+
+    return pd.DataFrame(
+        {
+            **{column: rates[column].to_numpy()[matched] for column in columns},
+            **{
+                column: dataframe[column].to_numpy()[rows]
+                for column in dataframe.columns
+            },
+        }
+    )
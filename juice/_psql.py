@@ -1,53 +1,181 @@
+from contextlib import contextmanager
 from datetime import datetime, UTC
+from functools import lru_cache, wraps
 import psycopg
 from psycopg.sql import SQL, Identifier, Literal, Composed
+from psycopg_pool import ConnectionPool
 import re
 
+from ._data import (
+    POOL_CONFIG,
+    PARTITIONED_CONSUMPTION_TABLE,
+    TARIFF_RATES_TABLE,
+    DAILY_COSTS_TABLE,
+    PRODUCT_TARIFFS_TABLE,
+)
 
+from . import _duckdb
+from ._duckdb import EmbeddedStore
+
+LDZ_PATTERN = re.compile(r"(?:Calorific Value, LDZ\()(\w+)[\)]")
+
+
+def create_pool(psql_config, pool_config=None):
+    """
+    Return an open connection pool for the PostgresQL connection settings.
+
+    The pool can be passed to any of the helpers in place of the connection settings dictionary.
+    """
+
+    settings = {**POOL_CONFIG, **(pool_config or {})}
+
+    return ConnectionPool(kwargs=psql_config, open=True, **settings)
+
+
+def embeddable(func):
+    """
+    Route calls made with an EmbeddedStore to the function of the same name in juice._duckdb.
+    """
+
+    @wraps(func)
+    def wrapper(psql_config, *args, **kwargs):
+        if isinstance(psql_config, EmbeddedStore):
+            return getattr(_duckdb, func.__name__)(psql_config, *args, **kwargs)
+        return func(psql_config, *args, **kwargs)
+
+    return wrapper
+
+
+def postgres_only(func):
+    """
+    Reject calls made with an EmbeddedStore to a helper that only exists for PostgresQL.
+    """
+
+    @wraps(func)
+    def wrapper(psql_config, *args, **kwargs):
+        if isinstance(psql_config, EmbeddedStore):
+            raise TypeError(
+                f"{func.__name__} needs a PostgresQL database and is not available with the embedded database."
+            )
+        return func(psql_config, *args, **kwargs)
+
+    return wrapper
+
+
+@contextmanager
+def connect(psql_config):
+    """
+    Yield a connection drawn from a pool or, for a settings dictionary, a new connection that is closed afterwards.
+    """
+
+    if isinstance(psql_config, EmbeddedStore):
+        raise TypeError(
+            "connect needs PostgresQL connection settings or a connection pool, the embedded database has no PostgresQL connection."
+        )
+
+    if isinstance(psql_config, ConnectionPool):
+        with psql_config.connection() as conn:
+            yield conn
+    else:
+        conn = psycopg.connect(**psql_config)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+
+@embeddable
 def create_updates_table(psql_config, table_name="updates"):
-    conn = psycopg.connect(**psql_config)
-    curr = conn.cursor()
+    with connect(psql_config) as conn:
+        curr = conn.cursor()
 
-    try:
-        curr.execute(
-            SQL(
+        try:
+            curr.execute(
+                SQL(
+                    """
+                CREATE TABLE IF NOT EXISTS {} (
+                    id serial PRIMARY KEY,
+                    name varchar unique not null,
+                    updated timestamptz not null
+                 )
                 """
-            CREATE TABLE IF NOT EXISTS {} (
-                id serial PRIMARY KEY,
-                name varchar unique not null,
-                updated timestamptz not null
-             )
-            """
-            ).format(Identifier(table_name))
-        )
+                ).format(Identifier(table_name))
+            )
 
-    except psycopg.errors.DuplicateTable:
-        pass
+        except psycopg.errors.DuplicateTable:
+            pass
 
-    conn.close()
     pass
 
 
+@embeddable
 def insert_updates(psql_config, updated_table_name, table_name="updates"):
-    conn = psycopg.connect(**psql_config)
-    curr = conn.cursor()
+    with connect(psql_config) as conn:
+        curr = conn.cursor()
+
+        try:
+            curr.execute(
+                SQL(
+                    """
+                INSERT INTO {} (name, updated) VALUES ({}, CURRENT_TIMESTAMP) \
+                    ON CONFLICT (name) DO UPDATE \
+                    SET updated = EXCLUDED.updated 
+                """
+                ).format(Identifier(table_name), Literal(updated_table_name))
+            )
+
+        except psycopg.errors.DuplicateTable:
+            pass
+
+    pass
+
+
+def query_all_updates(psql_config, table_name="updates"):
+    """
+    Return the whole updates table as a dictionary of names and update times.
+    """
+
+    query = SQL("select name, updated from {}").format(Identifier(table_name))
 
     try:
-        curr.execute(
+        return dict(retrive(psql_config, query))
+    except ValueError:
+        return {}
+
+
+def query_rates_coverage(psql_config, unified=False):
+    """
+    Return the latest valid_to of every stored rates source and whether any of its rates are open ended, keyed by the rates table name, in one query per kind of storage.
+    """
+
+    if unified:
+        query = SQL(
+            "select tariff_code || '_' || cost_type, max(valid_to), bool_or(valid_to is null) from {} group by tariff_code, cost_type"
+        ).format(Identifier(TARIFF_RATES_TABLE))
+    else:
+        tables = retrive(
+            psql_config,
             SQL(
-                """
-            INSERT INTO {} (name, updated) VALUES ({}, CURRENT_TIMESTAMP) \
-                ON CONFLICT (name) DO UPDATE \
-                SET updated = EXCLUDED.updated 
-            """
-            ).format(Identifier(table_name), Literal(updated_table_name))
+                "SELECT tablename FROM pg_catalog.pg_tables where (tablename like '%standard_unit_rates' or tablename like '%standing_charges') and tablename <> {}"
+            ).format(Literal(TARIFF_RATES_TABLE)),
         )
+        if not tables:
+            return {}
 
-    except psycopg.errors.DuplicateTable:
-        pass
+        query = SQL(" union all ").join(
+            SQL(
+                "select {}, max(valid_to), coalesce(bool_or(valid_to is null), false) from {}"
+            ).format(Literal(table[0]), Identifier(table[0]))
+            for table in tables
+        )
 
-    conn.close()
-    pass
+    try:
+        return {
+            name: (latest, open_ended)
+            for name, latest, open_ended in retrive(psql_config, query)
+        }
+    except ValueError:
+        return {}
 
 
 def query_updates(psql_config, updated_table_name, table_name="updates"):
@@ -62,51 +190,51 @@ def query_updates(psql_config, updated_table_name, table_name="updates"):
     return r
 
 
+@embeddable
 def create_octopus_products_db(psql_config, table_name="products_octopus_energy"):
-    conn = psycopg.connect(**psql_config)
-    curr = conn.cursor()
+    with connect(psql_config) as conn:
+        curr = conn.cursor()
 
-    try:
-        curr.execute(
-            SQL(
+        try:
+            curr.execute(
+                SQL(
+                    """
+                CREATE TABLE {} (
+                    id serial PRIMARY KEY,
+                    code varchar unique not null,
+                    full_name varchar not null,
+                    display_name varchar not null,
+                    description varchar not null,
+                    is_variable bool not null,
+                    is_green bool not null,
+                    is_tracker bool not null,
+                    is_prepay bool not null,
+                    is_business bool not null,
+                    is_restricted bool not null,
+                    term smallint,
+                    available_from timestamptz not null,
+                    available_to timestamptz,
+                    added timestamptz default CURRENT_TIMESTAMP,
+                    updated timestamptz,
+                    brand varchar not null
+                 )
                 """
-            CREATE TABLE {} (
-                id serial PRIMARY KEY,
-                code varchar unique not null,
-                full_name varchar not null,
-                display_name varchar not null,
-                description varchar not null,
-                is_variable bool not null,
-                is_green bool not null,
-                is_tracker bool not null,
-                is_prepay bool not null,
-                is_business bool not null,
-                is_restricted bool not null,
-                term smallint,
-                available_from timestamptz not null,
-                available_to timestamptz,
-                added timestamptz default CURRENT_TIMESTAMP,
-                updated timestamptz,
-                brand varchar not null
-             )
-            """
-            ).format(Identifier(table_name))
-        )
+                ).format(Identifier(table_name))
+            )
 
-    except psycopg.errors.DuplicateTable:
-        pass
+        except psycopg.errors.DuplicateTable:
+            pass
 
-    conn.close()
     pass
 
 
+@embeddable
 def insert_octopus_energy_products(
     psql_config, data, table_name="products_octopus_energy"
 ):
-    conn = psycopg.connect(**psql_config)
-    curr = conn.cursor()
+    with connect(psql_config) as conn:
+        curr = conn.cursor()
 
-    for row in data:
         insert_query = SQL(
             "INSERT INTO {} (code, full_name, display_name, description, is_variable, is_green, is_tracker, is_prepay, is_business, is_restricted, term, available_from, available_to, brand) \
                 VALUES (%(code)s, %(full_name)s, %(display_name)s, %(description)s, %(is_variable)s, %(is_green)s, %(is_tracker)s, %(is_prepay)s, %(is_business)s, %(is_restricted)s, %(term)s, %(available_from)s, %(available_to)s, %(brand)s)\
@@ -127,12 +255,75 @@ def insert_octopus_energy_products(
                             updated = CURRENT_TIMESTAMP, \
                             brand = EXCLUDED.brand"
         ).format(Identifier(table_name))
+
+        # executemany sends the whole batch through psycopg's pipeline mode
+        curr.executemany(insert_query, data)
+
+
+# the single register tariffs of a product detail page, keyed by region and then payment method
+PRODUCT_TARIFF_KEYS = {
+    "single_register_electricity_tariffs": "electricity",
+    "single_register_gas_tariffs": "gas",
+}
+PRODUCT_TARIFF_COLUMNS = [
+    "product_code",
+    "energy_type",
+    "region",
+    "payment_method",
+    "tariff_code",
+]
+
+
+def _product_tariff_rows(products):
+    for product in products:
+        for key, energy_type in PRODUCT_TARIFF_KEYS.items():
+            for region, payment_methods in product.get(key, {}).items():
+                for payment_method, tariff in payment_methods.items():
+                    yield {
+                        "product_code": product["code"],
+                        "energy_type": energy_type,
+                        "region": region.lstrip("_"),
+                        "payment_method": payment_method,
+                        "tariff_code": tariff["code"],
+                    }
+
+
+@embeddable
+def create_product_tariffs_db(psql_config, table_name=PRODUCT_TARIFFS_TABLE):
+    with connect(psql_config) as conn:
+        curr = conn.cursor()
+
         try:
-            curr.execute(insert_query, row)
-        except psycopg.errors.UniqueViolation:
-            raise
+            # the unique index doubles as the lookup index for a product's tariff in a region
+            curr.execute(
+                SQL(
+                    """
+                CREATE TABLE {} (
+                    product_code varchar not null,
+                    energy_type varchar not null,
+                    region char(1) not null,
+                    payment_method varchar not null,
+                    tariff_code varchar not null,
+                    unique (product_code, energy_type, region, payment_method)
+                 )
+                """
+                ).format(Identifier(table_name))
+            )
+
+        except psycopg.errors.DuplicateTable:
+            pass
+
 
-    conn.close()
+@embeddable
+def insert_product_tariffs(psql_config, products, table_name=PRODUCT_TARIFFS_TABLE):
+
+    copy_upsert(
+        psql_config,
+        _product_tariff_rows(products),
+        table_name,
+        PRODUCT_TARIFF_COLUMNS,
+        ["product_code", "energy_type", "region", "payment_method"],
+    )
 
 
 def query_tariff_family(psql_config, display_name, brand="OCTOPUS_ENERGY"):
@@ -159,33 +350,87 @@ def query_octopus_product_not_in_database(psql_config, products_list):
     return [x[0] for x in retrive(psql_config, query)]
 
 
-def query_octopus_product_by_product_code(psql_config, display_name, energy_type, gsp):
+def query_product_availability(psql_config, table_name="products_octopus_energy"):
+    """
+    Return the stored available_from and available_to of every product whose regional tariffs are stored, keyed by its code.
+    """
+
     query = SQL(
-        "select code, full_name, display_name, available_from, available_to from products_octopus_energy \
-            where code = {} and brand = 'OCTOPUS_ENERGY'"
-    ).format(Literal(display_name))
+        "select p.code, p.available_from, p.available_to from {} p \
+            where exists (select 1 from {} t where t.product_code = p.code)"
+    ).format(Identifier(table_name), Identifier(PRODUCT_TARIFFS_TABLE))
 
-    return prep_octopus_results(psql_config, query, energy_type, gsp)
+    try:
+        result = retrive(psql_config, query)
+    except ValueError:
+        return {}
+
+    return {
+        code: (available_from, available_to)
+        for code, available_from, available_to in result
+    }
+
+
+def query_octopus_product_by_product_code(psql_config, display_name, energy_type, gsp):
+    condition = SQL("code = {}").format(Literal(display_name))
+
+    return prep_octopus_results(psql_config, condition, energy_type, gsp)
 
 
 def query_octopus_product_by_family_name(psql_config, display_name, energy_type, gsp):
-    query = SQL(
-        "select code, full_name, display_name, available_from, available_to from products_octopus_energy \
-            where display_name = {} and brand = 'OCTOPUS_ENERGY'"
-    ).format(Literal(display_name))
+    condition = SQL("display_name = {}").format(Literal(display_name))
 
-    return prep_octopus_results(psql_config, query, energy_type, gsp)
+    return prep_octopus_results(psql_config, condition, energy_type, gsp)
 
 
-def prep_octopus_results(psql_config, query, energy_type, gsp):
-    result = retrive(psql_config, query)
+def _query_product_tariff_codes(psql_config, condition, energy_type, gsp):
+    """
+    Return the products matching condition joined with their tariff code in the gsp region. Products whose tariffs were never downloaded, e.g. withdrawn products, keep a tariff code guessed from the product code, while products with tariffs only in other regions or for the other energy type are left out. Direct debit tariffs are preferred when a region has several payment methods.
+    """
+
+    query = SQL(
+        "select distinct on (p.code) p.code, p.full_name, p.display_name, p.available_from, p.available_to, \
+            coalesce(t.tariff_code, {} || p.code || '-' || {}) \
+                from products_octopus_energy p left join {} t on t.product_code = p.code and t.energy_type = {} and t.region = {} \
+                    where p.brand = 'OCTOPUS_ENERGY' and {} \
+                        and (t.tariff_code is not null or not exists (select 1 from {} d where d.product_code = p.code)) \
+                            order by p.code, t.payment_method <> 'direct_debit_monthly', t.payment_method"
+    ).format(
+        Literal(_tariff_prefix(energy_type)),
+        Literal(gsp),
+        Identifier(PRODUCT_TARIFFS_TABLE),
+        Literal(energy_type),
+        Literal(gsp),
+        condition,
+        Identifier(PRODUCT_TARIFFS_TABLE),
+    )
+
+    return retrive(psql_config, query)
 
-    x = sorted(result, key=lambda d: d[3])
 
+def _tariff_prefix(energy_type):
     if energy_type == "electricity":
-        prefix = "E-1R-"
-    else:
-        prefix = "G-1R-"
+        return "E-1R-"
+    return "G-1R-"
+
+
+def prep_octopus_results(psql_config, condition, energy_type, gsp):
+
+    try:
+        x = _query_product_tariff_codes(psql_config, condition, energy_type, gsp)
+    except ValueError:
+        # tariff codes are guessed from the product code until the regional tariffs have been downloaded
+        query = SQL(
+            "select code, full_name, display_name, available_from, available_to from products_octopus_energy \
+                where brand = 'OCTOPUS_ENERGY' and {}"
+        ).format(condition)
+
+        x = [
+            (*item, _tariff_prefix(energy_type) + item[0] + "-" + gsp)
+            for item in retrive(psql_config, query)
+        ]
+
+    x = sorted(x, key=lambda d: d[3])
 
     tariff_list = []
     for index, item in enumerate(x):
@@ -199,7 +444,7 @@ def prep_octopus_results(psql_config, query, energy_type, gsp):
             {
                 "name": item[2],
                 "tariff": item[0],
-                "tariff_code": prefix + item[0] + "-" + gsp,
+                "tariff_code": item[5],
                 "valid_from": item[3],
                 "valid_to": valid_to,
             }
@@ -220,10 +465,20 @@ def query_octopus_unique_tariff_family(
 
 
 @staticmethod
-def query_existing_products_tables(psql_config):
+def query_existing_products_tables(psql_config, unified=False):
+    if unified:
+        # served from the leading column of the tariff rates unique index
+        query = SQL("SELECT DISTINCT tariff_code FROM {}").format(
+            Identifier(TARIFF_RATES_TABLE)
+        )
+        try:
+            return [{"tariff_code": code[0]} for code in retrive(psql_config, query)]
+        except ValueError:
+            return []
+
     query = SQL(
-        "SELECT tablename FROM pg_catalog.pg_tables where tablename like '%rates' or tablename like '%charges'"
-    )
+        "SELECT tablename FROM pg_catalog.pg_tables where (tablename like '%rates' or tablename like '%charges') and tablename <> {}"
+    ).format(Literal(TARIFF_RATES_TABLE))
     result = retrive(psql_config, query)
     try:
         r = [
@@ -239,55 +494,73 @@ def query_existing_products_tables(psql_config):
     return r
 
 
+@embeddable
 def create_calorific_value_db(psql_config, table_name="calorific_values"):
 
-    conn = psycopg.connect(**psql_config)
-    curr = conn.cursor()
+    with connect(psql_config) as conn:
+        curr = conn.cursor()
 
-    try:
-        curr.execute(
-            SQL(
+        try:
+            curr.execute(
+                SQL(
+                    """
+                CREATE TABLE {} (
+                    id serial PRIMARY KEY,
+                    applicable_date timestamptz not null,
+                    exit_zone varchar not null,
+                    calorific_value numeric not null,
+                    unique (applicable_date, exit_zone)
+                 )
                 """
-            CREATE TABLE {} (
-                id serial PRIMARY KEY,
-                applicable_date timestamptz unique not null,
-                exit_zone varchar not null,
-                calorific_value numeric not null,
-                unique (applicable_date, exit_zone)
-             )
-            """
-            ).format(Identifier(table_name))
-        )
-
-    except psycopg.errors.DuplicateTable:
-        pass
-
-    conn.close()
+                ).format(Identifier(table_name))
+            )
+
+        except psycopg.errors.DuplicateTable:
+            # older tables allowed a single LDZ per date, the catalog is checked first as ALTER TABLE locks the table even when there is nothing to drop
+            constraint = table_name + "_applicable_date_key"
+            curr.execute(
+                SQL(
+                    "select 1 from pg_constraint where conrelid = to_regclass({}) and conname = {}"
+                ).format(
+                    Literal(Identifier(table_name).as_string(conn)), Literal(constraint)
+                )
+            )
+            if curr.fetchone():
+                curr.execute(
+                    SQL("ALTER TABLE {} DROP CONSTRAINT IF EXISTS {}").format(
+                        Identifier(table_name), Identifier(constraint)
+                    )
+                )
+
+
+@lru_cache(maxsize=4096)
+def _parse_gas_day(date):
+    return datetime.strptime(date, "%d/%m/%Y")
+
+
+def _calorific_rows(results):
+    # extracts the LDZ code from the string i.e. 'NW', each date is repeated for every LDZ so it is only parsed once
+    for row in results:
+        yield {
+            "applicable_date": _parse_gas_day(row[1]),
+            "exit_zone": LDZ_PATTERN.search(row[2]).group(1),
+            "calorific_value": row[3],
+        }
 
 
+@embeddable
 def insert_calorific(psql_config, results, table_name="calorific_values"):
 
-    conn = psycopg.connect(**psql_config)
-    curr = conn.cursor()
-
-    for row in results:
-        # extracts the LDZ code from the string i.e. 'NW' and replaces it back into the row
-        row[2] = re.findall(r"(?:Calorific Value, LDZ\()(\w+)[\)]", row[2])[0]
-        row[1] = datetime.strptime(row[1], "%d/%m/%Y")
-        insert_query = SQL(
-            "INSERT INTO {} (applicable_date, exit_zone, calorific_value) \
-                VALUES (%s, %s, %s)\
-                    ON CONFLICT (applicable_date, exit_zone) DO UPDATE \
-                        SET calorific_value = EXCLUDED.calorific_value"
-        ).format(Identifier(table_name))
-        try:
-            curr.execute(insert_query, row[1:4])
-        except psycopg.errors.UniqueViolation:
-            raise
-
-    conn.close()
+    copy_upsert(
+        psql_config,
+        _calorific_rows(results),
+        table_name,
+        ["applicable_date", "exit_zone", "calorific_value"],
+        ["applicable_date", "exit_zone"],
+    )
 
 
+@embeddable
 def query_missing_calorific(psql_config, date, ldz, table_name="calorific_values"):
 
     query = SQL(
@@ -302,155 +575,572 @@ def query_missing_calorific(psql_config, date, ldz, table_name="calorific_values
         return date
 
 
+@embeddable
 def create_consumption_db(psql_config, table_name="consumption"):
 
-    conn = psycopg.connect(**psql_config)
-    curr = conn.cursor()
+    with connect(psql_config) as conn:
+        curr = conn.cursor()
+
+        try:
+            curr.execute(
+                SQL(
+                    """
+                CREATE TABLE {} (
+                    id serial PRIMARY KEY,
+                    consumption numeric not null,
+                    interval_start timestamptz not null,
+                    interval_end timestamptz not null,
+                    unique (interval_start, interval_end)
+                    )"""
+                ).format(Identifier(table_name))
+            )
+
+            curr.execute(
+                SQL(
+                    "create index on {} using gist (tstzrange(interval_start,interval_end))"
+                ).format(Identifier(table_name))
+            )
+
+        except psycopg.errors.DuplicateTable:
+            pass
+
+
+@embeddable
+def insert_consumption(psql_config, results, table_name="consumption"):
+
+    copy_upsert(
+        psql_config,
+        results,
+        table_name,
+        ["consumption", "interval_start", "interval_end"],
+        ["interval_start", "interval_end"],
+    )
+
+
+@postgres_only
+def create_partitioned_consumption_db(
+    psql_config, table_name=PARTITIONED_CONSUMPTION_TABLE
+):
+
+    with connect(psql_config) as conn:
+        curr = conn.cursor()
+
+        try:
+            curr.execute(
+                SQL(
+                    """
+                CREATE TABLE {} (
+                    account_id varchar not null,
+                    mpan_or_mprn varchar not null,
+                    serial_number varchar not null,
+                    consumption numeric not null,
+                    interval_start timestamptz not null,
+                    interval_end timestamptz not null,
+                    primary key (account_id, mpan_or_mprn, serial_number, interval_start, interval_end)
+                    ) PARTITION BY RANGE (interval_start)"""
+                ).format(Identifier(table_name))
+            )
+
+            curr.execute(
+                SQL(
+                    "create index on {} using gist (tstzrange(interval_start,interval_end))"
+                ).format(Identifier(table_name))
+            )
+
+        # a table created by a concurrent transaction can also surface as a clash in pg_type
+        except (psycopg.errors.DuplicateTable, psycopg.errors.UniqueViolation):
+            pass
+
+
+@postgres_only
+def create_consumption_partitions(
+    psql_config, from_date, to_date, table_name=PARTITIONED_CONSUMPTION_TABLE
+):
+    """
+    Create the monthly partitions of table_name covering from_date up to and including to_date.
+    """
+
+    from_date = from_date.astimezone(UTC)
+    to_date = to_date.astimezone(UTC)
+
+    month = datetime(from_date.year, from_date.month, 1, tzinfo=UTC)
+    last = datetime(to_date.year, to_date.month, 1, tzinfo=UTC)
+
+    with connect(psql_config) as conn:
+        curr = conn.cursor()
+
+        while month <= last:
+            if month.month == 12:
+                next_month = month.replace(year=month.year + 1, month=1)
+            else:
+                next_month = month.replace(month=month.month + 1)
+
+            # meters loaded at the same time can race to create the same partition, the loser's savepoint is rolled back
+            try:
+                with conn.transaction():
+                    curr.execute(
+                        SQL(
+                            "CREATE TABLE IF NOT EXISTS {} PARTITION OF {} FOR VALUES FROM ({}) TO ({})"
+                        ).format(
+                            Identifier(f"{table_name}_{month.strftime('%Y_%m')}"),
+                            Identifier(table_name),
+                            Literal(month),
+                            Literal(next_month),
+                        )
+                    )
+            except (psycopg.errors.DuplicateTable, psycopg.errors.UniqueViolation):
+                pass
+
+            month = next_month
+
+
+def insert_partitioned_consumption(
+    psql_config, results, meter, table_name=PARTITIONED_CONSUMPTION_TABLE
+):
+
+    results = [{**item, **meter} for item in results]
+    if not results:
+        return
+
+    starts = [_to_datetime(item["interval_start"]) for item in results]
+    create_consumption_partitions(psql_config, min(starts), max(starts), table_name)
+
+    copy_upsert(
+        psql_config,
+        results,
+        table_name,
+        [
+            "account_id",
+            "mpan_or_mprn",
+            "serial_number",
+            "consumption",
+            "interval_start",
+            "interval_end",
+        ],
+        [
+            "account_id",
+            "mpan_or_mprn",
+            "serial_number",
+            "interval_start",
+            "interval_end",
+        ],
+    )
+
+
+def count_partitioned_consumption(
+    psql_config, meter, table_name=PARTITIONED_CONSUMPTION_TABLE
+):
+
+    query = SQL("select count(*) from {} where {}").format(
+        Identifier(table_name), _meter_condition(meter)
+    )
+
+    return retrive(psql_config, query)[0][0]
+
+
+@postgres_only
+def delete_partitioned_consumption(
+    psql_config, meter, table_name=PARTITIONED_CONSUMPTION_TABLE
+):
+
+    with connect(psql_config) as conn:
+        curr = conn.cursor()
+        try:
+            curr.execute(
+                SQL("delete from {} where {}").format(
+                    Identifier(table_name), _meter_condition(meter)
+                )
+            )
+        except psycopg.errors.UndefinedTable:
+            pass
+
+
+@postgres_only
+def migrate_consumption_table(
+    psql_config,
+    source_table,
+    meter,
+    drop=False,
+    table_name=PARTITIONED_CONSUMPTION_TABLE,
+):
+    """
+    Copy a per meter consumption table into the partitioned consumption table, optionally dropping the source table afterwards.
+    """
+
+    query = SQL("select min(interval_start), max(interval_start) from {}").format(
+        Identifier(source_table)
+    )
 
     try:
-        curr.execute(
-            SQL(
-                """
-            CREATE TABLE {} (
-                id serial PRIMARY KEY,
-                consumption numeric not null,
-                interval_start timestamptz not null,
-                interval_end timestamptz not null,
-                unique (interval_start, interval_end)
-                )"""
-            ).format(Identifier(table_name))
-        )
+        min_date, max_date = retrive(psql_config, query)[0]
+    except ValueError:
+        print(f"There is no consumption table {source_table} to migrate.")
+        return
 
-        curr.execute(
-            SQL(
-                "create index on {} using gist (tstzrange(interval_start,interval_end))"
-            ).format(Identifier(table_name))
+    create_partitioned_consumption_db(psql_config, table_name)
+
+    if min_date is None:
+        print(f"{source_table} is empty.")
+    else:
+        create_consumption_partitions(psql_config, min_date, max_date, table_name)
+
+        with connect(psql_config) as conn:
+            curr = conn.cursor()
+            curr.execute(
+                SQL(
+                    "INSERT INTO {} (account_id, mpan_or_mprn, serial_number, consumption, interval_start, interval_end) \
+                        SELECT {}, {}, {}, consumption, interval_start, interval_end FROM {} \
+                            ON CONFLICT DO NOTHING"
+                ).format(
+                    Identifier(table_name),
+                    Literal(meter["account_id"]),
+                    Literal(meter["mpan_or_mprn"]),
+                    Literal(meter["serial_number"]),
+                    Identifier(source_table),
+                )
+            )
+            print(f"Migrated {curr.rowcount} rows from {source_table}.")
+
+    if drop:
+        drop_table(psql_config, source_table)
+
+
+def query_latest_interval_end(psql_config, table_name, meter=None):
+    """
+    Return the end of the latest stored consumption interval or None when there is none.
+    """
+
+    query = SQL("select max(interval_end) from {}").format(Identifier(table_name))
+    if meter:
+        query += SQL(" where {}").format(_meter_condition(meter))
+
+    try:
+        return retrive(psql_config, query)[0][0]
+    except ValueError:
+        return None
+
+
+def query_latest_interval_start(psql_config, table_name):
+    """
+    Return the start of the latest stored consumption interval or None when there is none.
+    """
+
+    query = SQL("select max(interval_start) from {}").format(Identifier(table_name))
+
+    try:
+        return retrive(psql_config, query)[0][0]
+    except ValueError:
+        return None
+
+
+def query_latest_valid_from(psql_config, table_name, tariff_code=None, cost_type=None):
+    """
+    Return the start of the newest stored rate or None when there is none. tariff_code and cost_type select the rows of the unified tariff rates table.
+    """
+
+    query = SQL("select max(valid_from) from {}").format(Identifier(table_name))
+    if tariff_code:
+        query += SQL(" where tariff_code = {} and cost_type = {}").format(
+            Literal(tariff_code), Literal(cost_type)
         )
 
-    except psycopg.errors.DuplicateTable:
-        pass
+    try:
+        return retrive(psql_config, query)[0][0]
+    except ValueError:
+        return None
 
-    conn.close()
 
+def query_consumption_gaps(psql_config, table_name, meter=None):
+    """
+    Return (gap_start, gap_end) pairs for the holes between consecutive stored consumption intervals.
+    """
 
-def insert_consumption(psql_config, results, table_name="consumption"):
+    if meter:
+        condition = SQL("where {}").format(_meter_condition(meter))
+    else:
+        condition = SQL("")
 
-    conn = psycopg.connect(**psql_config)
-    curr = conn.cursor()
+    query = SQL(
+        "select interval_end, next_start from ( \
+            select interval_end, lead(interval_start) over (order by interval_start) as next_start from {} {} \
+                ) as intervals where next_start > interval_end order by interval_end"
+    ).format(Identifier(table_name), condition)
 
-    for item in results:
-        insert_query = SQL(
-            "INSERT INTO {} (consumption, interval_start, interval_end) \
-                VALUES (%(consumption)s, %(interval_start)s, %(interval_end)s)\
-                    ON CONFLICT (interval_start, interval_end) DO UPDATE \
-                        SET consumption = EXCLUDED.consumption"
-        ).format(Identifier(table_name))
-        try:
-            curr.execute(insert_query, item)
-        except psycopg.errors.UniqueViolation:
-            raise
+    try:
+        return retrive(psql_config, query)
+    except ValueError:
+        return []
 
-    conn.close()
 
+def _meter_condition(meter):
+    return SQL("account_id = {} and mpan_or_mprn = {} and serial_number = {}").format(
+        Literal(meter["account_id"]),
+        Literal(meter["mpan_or_mprn"]),
+        Literal(meter["serial_number"]),
+    )
 
+
+def _to_datetime(date):
+    if isinstance(date, str):
+        return datetime.fromisoformat(date)
+    return date
+
+
+@embeddable
 def create_unit_rates_db(psql_config, table_name="unit_rates"):
 
-    conn = psycopg.connect(**psql_config)
-    curr = conn.cursor()
-    try:
-        curr.execute(
-            SQL(
-                """
+    with connect(psql_config) as conn:
+        curr = conn.cursor()
+        try:
+            curr.execute(
+                SQL(
+                    """
+                    CREATE TABLE {} (
+                        id serial PRIMARY KEY,
+                        value_inc_vat numeric not null,
+                        value_exc_vat numeric not null,
+                        valid_from timestamptz,
+                        valid_to timestamptz,
+                        payment_method char(16),
+                        unique nulls not distinct (valid_from, payment_method)
+                    )"""
+                ).format(Identifier(table_name))
+            )
+
+            curr.execute(
+                SQL(
+                    "create index on {} using gist (tstzrange(valid_from,valid_to))"
+                ).format(Identifier(table_name))
+            )
+
+        except psycopg.errors.DuplicateTable:
+            pass
+
+
+@embeddable
+def insert_unit_rates(psql_config, results, table_name="unit_rates"):
+
+    copy_upsert(
+        psql_config,
+        results,
+        table_name,
+        ["value_inc_vat", "value_exc_vat", "valid_from", "valid_to", "payment_method"],
+        ["valid_from", "payment_method"],
+    )
+
+
+@postgres_only
+def copy_upsert(psql_config, results, table_name, columns, conflict_columns):
+    """
+    Stream rows through COPY into a temporary staging table and merge them into table_name with a single upsert.
+
+    results can be any iterable of dictionaries keyed by columns, e.g. an API page or a generator spanning a whole sync run. Rows sharing the same conflict_columns are reduced to the last one seen so the upsert never touches a row twice.
+    """
+
+    staging = Identifier("juice_staging")
+    update_columns = [n for n in columns if n not in conflict_columns]
+
+    with connect(psql_config) as conn:
+        curr = conn.cursor()
+
+        with conn.transaction():
+            curr.execute(
+                SQL(
+                    "CREATE TEMP TABLE {} ON COMMIT DROP AS SELECT {} FROM {} WITH NO DATA"
+                ).format(
+                    staging,
+                    SQL(", ").join(map(Identifier, columns)),
+                    Identifier(table_name),
+                )
+            )
+            curr.execute(
+                SQL("ALTER TABLE {} ADD COLUMN row_number bigserial").format(staging)
+            )
+
+            with curr.copy(
+                SQL("COPY {} ({}) FROM STDIN").format(
+                    staging, SQL(", ").join(map(Identifier, columns))
+                )
+            ) as copy:
+                for item in results:
+                    copy.write_row([item[n] for n in columns])
+
+            curr.execute(
+                SQL(
+                    "INSERT INTO {table} ({columns}) \
+                        SELECT DISTINCT ON ({conflict}) {columns} FROM {staging} \
+                            ORDER BY {conflict}, row_number DESC \
+                                ON CONFLICT ({conflict}) DO UPDATE SET {update}"
+                ).format(
+                    table=Identifier(table_name),
+                    columns=SQL(", ").join(map(Identifier, columns)),
+                    conflict=SQL(", ").join(map(Identifier, conflict_columns)),
+                    staging=staging,
+                    update=SQL(", ").join(
+                        SQL("{} = EXCLUDED.{}").format(Identifier(n), Identifier(n))
+                        for n in update_columns
+                    ),
+                )
+            )
+
+
+@postgres_only
+def create_tariff_rates_db(psql_config, table_name=TARIFF_RATES_TABLE):
+
+    with connect(psql_config) as conn:
+        curr = conn.cursor()
+        try:
+            curr.execute(
+                SQL(
+                    """
                 CREATE TABLE {} (
-                    id serial PRIMARY KEY,
+                    id bigserial PRIMARY KEY,
+                    tariff_code varchar not null,
+                    cost_type varchar not null,
                     value_inc_vat numeric not null,
                     value_exc_vat numeric not null,
                     valid_from timestamptz,
                     valid_to timestamptz,
                     payment_method char(16),
-                    unique nulls not distinct (valid_from, payment_method)
+                    unique nulls not distinct (tariff_code, cost_type, payment_method, valid_from)
                 )"""
-            ).format(Identifier(table_name))
-        )
+                ).format(Identifier(table_name))
+            )
 
-        curr.execute(
-            SQL(
-                "create index on {} using gist (tstzrange(valid_from,valid_to))"
-            ).format(Identifier(table_name))
-        )
+            curr.execute(
+                SQL(
+                    "create index on {} using gist (tstzrange(valid_from,valid_to))"
+                ).format(Identifier(table_name))
+            )
 
-    except psycopg.errors.DuplicateTable:
-        pass
+        # a table created by a concurrent transaction can also surface as a clash in pg_type
+        except (psycopg.errors.DuplicateTable, psycopg.errors.UniqueViolation):
+            pass
 
-    conn.close()
 
+def insert_tariff_rates(
+    psql_config, results, tariff_code, cost_type, table_name=TARIFF_RATES_TABLE
+):
 
-def insert_unit_rates(psql_config, results, table_name="unit_rates"):
-    conn = psycopg.connect(**psql_config)
-    curr = conn.cursor()
+    copy_upsert(
+        psql_config,
+        (
+            {**item, "tariff_code": tariff_code, "cost_type": cost_type}
+            for item in results
+        ),
+        table_name,
+        [
+            "tariff_code",
+            "cost_type",
+            "value_inc_vat",
+            "value_exc_vat",
+            "valid_from",
+            "valid_to",
+            "payment_method",
+        ],
+        ["tariff_code", "cost_type", "payment_method", "valid_from"],
+    )
 
-    for item in results:
-        insert_query = SQL(
-            "INSERT INTO {} (value_inc_vat, value_exc_vat, valid_from, valid_to, payment_method) \
-                VALUES (%(value_inc_vat)s, %(value_exc_vat)s, %(valid_from)s, %(valid_to)s, %(payment_method)s)\
-                    ON CONFLICT (valid_from, payment_method) DO UPDATE \
-                        SET value_inc_vat = EXCLUDED.value_inc_vat, \
-                            value_exc_vat = EXCLUDED.value_exc_vat, \
-                                    valid_to = EXCLUDED.valid_to"
-        ).format(Identifier(table_name))
 
-        try:
-            curr.execute(insert_query, item)
-        except psycopg.errors.UniqueViolation:
-            raise
+def count_tariff_rates(
+    psql_config, tariff_code, cost_type, table_name=TARIFF_RATES_TABLE
+):
 
-    conn.close()
+    query = SQL(
+        "select count(*) from {} where tariff_code = {} and cost_type = {}"
+    ).format(Identifier(table_name), Literal(tariff_code), Literal(cost_type))
 
+    return retrive(psql_config, query)[0][0]
 
-def drop_table(psql_config, table_name):
 
-    conn = psycopg.connect(**psql_config)
-    curr = conn.cursor()
-    curr.execute(SQL("drop table if exists {}").format(Identifier(table_name)))
+@postgres_only
+def delete_tariff_rates(
+    psql_config, tariff_code, cost_type, table_name=TARIFF_RATES_TABLE
+):
+
+    with connect(psql_config) as conn:
+        curr = conn.cursor()
+        try:
+            curr.execute(
+                SQL("delete from {} where tariff_code = {} and cost_type = {}").format(
+                    Identifier(table_name), Literal(tariff_code), Literal(cost_type)
+                )
+            )
+        except psycopg.errors.UndefinedTable:
+            pass
+
+
+@embeddable
+def drop_table(psql_config, table_name):
 
-    conn.close()
+    with connect(psql_config) as conn:
+        curr = conn.cursor()
+        curr.execute(SQL("drop table if exists {}").format(Identifier(table_name)))
 
 
+@embeddable
 def count(psql_config, table_name):
-    conn = psycopg.connect(**psql_config)
-    curr = conn.cursor()
-    query = SQL("select count(id) from {}").format(Identifier(table_name))
-    curr.execute(query)
-    result = curr.fetchone()
-    conn.close()
+    with connect(psql_config) as conn:
+        curr = conn.cursor()
+        query = SQL("select count(id) from {}").format(Identifier(table_name))
+        curr.execute(query)
+        result = curr.fetchone()
     return result[0]
 
 
+@embeddable
 def retrive(psql_config, query, params=None):
 
-    conn = psycopg.connect(**psql_config)
-    curr = conn.cursor()
+    with connect(psql_config) as conn:
+        curr = conn.cursor()
 
-    try:
-        curr.execute(query, params)
-        # print(query.as_string(curr))
-    except psycopg.errors.UndefinedTable:
-        raise ValueError
+        try:
+            curr.execute(query, params)
+            # print(query.as_string(curr))
+        except psycopg.errors.UndefinedTable:
+            raise ValueError
 
-    result = curr.fetchall()
-    conn.close()
+        result = curr.fetchall()
     return result
 
 
-def retrive_consumption(psql_config, table_name, from_date, to_date):
+def retrive_consumption(psql_config, table_name, from_date, to_date, meter=None):
 
     query = SQL(
         "select consumption, interval_start, interval_end from {} where interval_start >= {} and interval_start < {}"  # (interval_start between {} and {})
     ).format(Identifier(table_name), from_date, to_date)
 
+    if meter:
+        # the interval_start bounds above let PostgresQL prune the monthly partitions
+        query += SQL(" and {}").format(_meter_condition(meter))
+
     return retrive(psql_config, query)
 
 
+def retrive_rounded_consumption(
+    psql_config, table_name, half_hours_table, from_date, to_date, meter=None
+):
+    """
+    Return the start of every consumption total in table_name starting between from_date and to_date, with the sum of its half hours in half_hours_table each rounded to 2 decimal places and their number. A total is costed like its half hours when it uses this sum.
+    """
+
+    query = SQL(
+        "select g.interval_start, sum(round(c.consumption, 2)), count(*) from {} g join {} c \
+            on c.interval_start >= g.interval_start and c.interval_start < g.interval_end \
+                where g.interval_start >= {} and g.interval_start < {}"
+    ).format(
+        Identifier(table_name),
+        Identifier(half_hours_table),
+        Literal(from_date),
+        Literal(to_date),
+    )
+
+    if meter:
+        query += SQL(" and {}").format(_meter_condition(meter))
+
+    return retrive(psql_config, query + SQL(" group by 1"))
+
+
 def retrive_unit_rates(psql_config, table_name, payment_method, from_date, to_date):
 
     query = SQL(
@@ -460,6 +1150,472 @@ def retrive_unit_rates(psql_config, table_name, payment_method, from_date, to_da
     return retrive(psql_config, query)
 
 
+def retrive_tariff_rates(
+    psql_config,
+    tariff_codes,
+    cost_type,
+    payment_method,
+    from_date,
+    to_date,
+    table_name=TARIFF_RATES_TABLE,
+):
+    """
+    Return the rates of every tariff in tariff_codes valid between from_date and to_date in one query.
+    """
+
+    query = SQL(
+        "select tariff_code, value_exc_vat, valid_from, valid_to from {} where tariff_code = any({}) and cost_type = {} and (payment_method is NULL or payment_method = {}) and (valid_from < {} and (valid_to > {} or valid_to is null))"
+    ).format(
+        Identifier(table_name),
+        Literal(list(tariff_codes)),
+        Literal(cost_type),
+        payment_method,
+        to_date,
+        from_date,
+    )
+
+    return retrive(psql_config, query)
+
+
+def _consumption_query(consumption_sources, from_date, to_date, LDZ=None):
+    """
+    Return a query over the consumption of every (table_name, meter) source between from_date and to_date. For gas, the consumption is joined with the LDZ calorific values and converted to kWh.
+    """
+
+    parts = []
+    for table_name, meter in consumption_sources:
+        query = SQL(
+            "select consumption, interval_start, interval_end from {} where interval_start >= {} and interval_start < {}"
+        ).format(Identifier(table_name), Literal(from_date), Literal(to_date))
+        if meter:
+            query += SQL(" and {}").format(_meter_condition(meter))
+        parts.append(query)
+
+    consumption = SQL(" union all ").join(parts)
+
+    if LDZ:
+        return SQL(
+            "select c.consumption, c.interval_start, c.interval_end, \
+                cv.calorific_value, round(c.consumption, 2) as consumption_units, \
+                    c.consumption * 1.02264 * cv.calorific_value / 3.6 as consumption_rounded \
+                        from ({}) c join calorific_values cv on cv.exit_zone = {} \
+                            and tstzrange(cv.applicable_date, cv.applicable_date + interval '1 day') && tstzrange(c.interval_start, c.interval_end)"
+        ).format(consumption, Literal(LDZ))
+
+    return SQL(
+        "select c.consumption, c.interval_start, c.interval_end, \
+            null::numeric as calorific_value, null::numeric as consumption_units, \
+                round(c.consumption, 2) as consumption_rounded from ({}) c"
+    ).format(consumption)
+
+
+def _rates_query(rate_sources, cost_type, payment_method, from_date=None, to_date=None):
+    """
+    Return a query over the rates of every agreement in rate_sources, each tagged with the agreement's validity window.
+
+    Each branch only selects the rates overlapping its agreement, narrowed to from_date and to_date when given, with a range condition the gist index on tstzrange(valid_from, valid_to) can answer.
+    """
+
+    parts = []
+    for source in rate_sources:
+        window = SQL(
+            "{}::timestamptz as agreement_from, {}::timestamptz as agreement_to"
+        ).format(Literal(source["valid_from"]), Literal(source["valid_to"]))
+
+        start = source["valid_from"]
+        if from_date and from_date > start:
+            start = from_date
+        end = source["valid_to"]
+        if to_date and (end is None or to_date < end):
+            end = to_date
+
+        condition = SQL(
+            "(payment_method is NULL or payment_method = {}) and tstzrange(valid_from, valid_to) && tstzrange({}, {})"
+        ).format(Literal(payment_method), Literal(start), Literal(end))
+
+        if "rate" in source:
+            query = SQL(
+                "select {}::numeric as rate, {}::timestamptz as valid_from, {}::timestamptz as valid_to, {}"
+            ).format(
+                Literal(source["rate"]),
+                Literal(source["valid_from"]),
+                Literal(source["valid_to"]),
+                window,
+            )
+        elif source.get("unified"):
+            query = SQL(
+                "select value_exc_vat as rate, valid_from, valid_to, {} from {} where tariff_code = {} and cost_type = {} and {}"
+            ).format(
+                window,
+                Identifier(TARIFF_RATES_TABLE),
+                Literal(source["tariff_code"]),
+                Literal(cost_type.strip("_")),
+                condition,
+            )
+        else:
+            query = SQL(
+                "select value_exc_vat as rate, valid_from, valid_to, {} from {} where {}"
+            ).format(window, Identifier(source["tariff_code"] + cost_type), condition)
+
+        parts.append(query)
+
+    return SQL(" union all ").join(parts)
+
+
+def _daily_costs_query(
+    consumption_sources,
+    rate_sources,
+    cost_type,
+    from_date,
+    to_date,
+    LDZ=None,
+    payment_method="DIRECT_DEBIT",
+):
+
+    if cost_type == "_standard_unit_rates":
+        cost = SQL("r.rate * c.consumption_rounded")
+    else:
+        cost = SQL(
+            "r.rate * extract(epoch from (c.interval_end - c.interval_start)) / 86400"
+        )
+
+    return SQL(
+        "select date_trunc('day', c.interval_start, 'Europe/London') as day, count(*), \
+            sum(c.consumption), sum(c.consumption_rounded), sum(c.consumption_units), avg(c.calorific_value), sum({cost}) \
+                from ({consumption}) c join ({rates}) r \
+                    on tstzrange(r.valid_from, r.valid_to) && tstzrange(c.interval_start, c.interval_end) \
+                        and c.interval_start >= r.agreement_from and c.interval_start < r.agreement_to \
+                            group by 1 order by 1"
+    ).format(
+        cost=cost,
+        consumption=_consumption_query(consumption_sources, from_date, to_date, LDZ),
+        rates=_rates_query(rate_sources, cost_type, payment_method, from_date, to_date),
+    )
+
+
+def retrive_daily_costs(
+    psql_config,
+    consumption_sources,
+    rate_sources,
+    cost_type,
+    from_date,
+    to_date,
+    LDZ=None,
+    payment_method="DIRECT_DEBIT",
+):
+    """
+    Join consumption with rates inside PostgresQL and return one row of totals per day, starting at midnight in London.
+
+    The consumption is bounded by interval_start and the rates of each agreement by a range overlap with its window, so both tables are read through their indexes. Each row holds the day, the number of half hours joined, the consumption, the consumption used for costing, the gas units, the mean calorific value and the cost.
+    """
+
+    query = _daily_costs_query(
+        consumption_sources,
+        rate_sources,
+        cost_type,
+        from_date,
+        to_date,
+        LDZ,
+        payment_method,
+    )
+
+    return retrive(psql_config, query)
+
+
+@postgres_only
+def create_daily_costs_db(psql_config, table_name=DAILY_COSTS_TABLE):
+
+    with connect(psql_config) as conn:
+        curr = conn.cursor()
+        try:
+            curr.execute(
+                SQL(
+                    """
+                CREATE TABLE {} (
+                    meter varchar not null,
+                    tariff_code varchar not null,
+                    cost_type varchar not null,
+                    day timestamptz not null,
+                    rows integer not null,
+                    consumption numeric not null,
+                    consumption_rounded numeric not null,
+                    consumption_units numeric,
+                    calorific_value numeric,
+                    cost numeric not null,
+                    rates_checksum numeric,
+                    primary key (meter, tariff_code, cost_type, day)
+                )"""
+                ).format(Identifier(table_name))
+            )
+
+        except psycopg.errors.DuplicateTable:
+            # older tables have no checksum, their days are all found stale and rolled up again
+            curr.execute(
+                SQL(
+                    "select 1 from information_schema.columns where table_name = {} and column_name = 'rates_checksum'"
+                ).format(Literal(table_name))
+            )
+            if not curr.fetchone():
+                curr.execute(
+                    SQL(
+                        "ALTER TABLE {} ADD COLUMN IF NOT EXISTS rates_checksum numeric"
+                    ).format(Identifier(table_name))
+                )
+
+
+def _rates_checksum_query(days, rate_source, cost_type, payment_method):
+    """
+    Return a query of the rates of rate_source weighted by the seconds each applies within every London day selected by days, a query with a day column. A rate corrected in place changes the checksum of its days.
+    """
+
+    return SQL(
+        "select d.day, coalesce(sum(r.rate * extract(epoch from \
+            least(coalesce(r.valid_to, 'infinity'), d.day_end) - greatest(coalesce(r.valid_from, '-infinity'), d.day))), 0) as checksum \
+                from (select day, (day at time zone 'Europe/London' + interval '1 day') at time zone 'Europe/London' as day_end from ({days}) days) d \
+                    left join ({rates}) r on tstzrange(r.valid_from, r.valid_to) && tstzrange(d.day, d.day_end) \
+                        group by d.day"
+    ).format(days=days, rates=_rates_query([rate_source], cost_type, payment_method))
+
+
+@postgres_only
+def refresh_daily_costs(
+    psql_config,
+    meter,
+    consumption_source,
+    rate_source,
+    cost_type,
+    from_date,
+    to_date,
+    LDZ=None,
+    table_name=DAILY_COSTS_TABLE,
+):
+    """
+    Recompute the daily costs of one meter on one tariff from from_date onwards and upsert them into the rollup table.
+
+    The stored days from from_date onwards are deleted first, so days rolled up under different day boundaries are not left behind. Each day is stored with the checksum of its rates.
+    """
+
+    delete = SQL(
+        "DELETE FROM {} WHERE meter = {} and tariff_code = {} and cost_type = {} and day >= {}"
+    ).format(
+        Identifier(table_name),
+        Literal(meter),
+        Literal(rate_source["tariff_code"]),
+        Literal(cost_type),
+        Literal(from_date),
+    )
+
+    query = SQL(
+        "WITH daily AS ({daily}) \
+            INSERT INTO {table} (meter, tariff_code, cost_type, day, rows, consumption, consumption_rounded, consumption_units, calorific_value, cost, rates_checksum) \
+                SELECT {meter}, {tariff_code}, {cost_type}, daily.*, x.checksum FROM daily join ({checksums}) x on x.day = daily.day \
+                    ON CONFLICT (meter, tariff_code, cost_type, day) DO UPDATE \
+                        SET rows = EXCLUDED.rows, \
+                            consumption = EXCLUDED.consumption, \
+                            consumption_rounded = EXCLUDED.consumption_rounded, \
+                            consumption_units = EXCLUDED.consumption_units, \
+                            calorific_value = EXCLUDED.calorific_value, \
+                            cost = EXCLUDED.cost, \
+                            rates_checksum = EXCLUDED.rates_checksum"
+    ).format(
+        daily=_daily_costs_query(
+            [consumption_source], [rate_source], cost_type, from_date, to_date, LDZ
+        ),
+        table=Identifier(table_name),
+        meter=Literal(meter),
+        tariff_code=Literal(rate_source["tariff_code"]),
+        cost_type=Literal(cost_type),
+        checksums=_rates_checksum_query(
+            SQL("select day from daily"), rate_source, cost_type, "DIRECT_DEBIT"
+        ),
+    )
+
+    with connect(psql_config) as conn:
+        curr = conn.cursor()
+        with conn.transaction():
+            curr.execute(delete)
+            curr.execute(query)
+
+
+def query_latest_daily_cost(
+    psql_config, meter, tariff_code, cost_type, table_name=DAILY_COSTS_TABLE
+):
+
+    query = SQL(
+        "select max(day) from {} where meter = {} and tariff_code = {} and cost_type = {}"
+    ).format(
+        Identifier(table_name), Literal(meter), Literal(tariff_code), Literal(cost_type)
+    )
+
+    return retrive(psql_config, query)[0][0]
+
+
+def query_earliest_stale_daily_cost(
+    psql_config,
+    meter,
+    consumption_source,
+    rate_source,
+    cost_type,
+    LDZ=None,
+    payment_method="DIRECT_DEBIT",
+    rates_changed=True,
+    table_name=DAILY_COSTS_TABLE,
+):
+    """
+    Return the earliest day within the dates covered by the rates of rate_source whose half hours or consumption differ from the ones rolled up for the meter, e.g. after a consumption backfill or once rates for older days were downloaded. None means every day matches.
+
+    With rates_changed, the checksum of each day's rates is compared as well, which finds rates corrected in place. It is left out when only the consumption changed, so the rates are not read.
+    """
+
+    if rates_changed:
+        checksums = SQL(
+            "left join ({}) x on x.day = days.day where d.rates_checksum is distinct from x.checksum or"
+        ).format(
+            _rates_checksum_query(
+                SQL("select day from days"), rate_source, cost_type, payment_method
+            )
+        )
+    else:
+        checksums = SQL("where")
+
+    query = SQL(
+        "with rates as (select min(valid_from) as first, max(coalesce(valid_to, 'infinity')) as last from ({rates}) r), \
+            days as (select date_trunc('day', c.interval_start, 'Europe/London') as day, count(*) as rows, \
+                sum(c.consumption) as consumption, sum(c.consumption_rounded) as consumption_rounded from ({consumption}) c, rates \
+                    where c.interval_start >= rates.first and c.interval_start < rates.last group by 1) \
+                        select min(days.day) from days left join {table} d \
+                            on d.meter = {meter} and d.tariff_code = {tariff_code} and d.cost_type = {cost_type} and d.day = days.day \
+                                {checksums} d.rows is distinct from days.rows or d.consumption is distinct from days.consumption \
+                                    or d.consumption_rounded is distinct from days.consumption_rounded"
+    ).format(
+        rates=_rates_query([rate_source], cost_type, payment_method),
+        consumption=_consumption_query(
+            [consumption_source],
+            rate_source["valid_from"],
+            rate_source["valid_to"],
+            LDZ,
+        ),
+        table=Identifier(table_name),
+        meter=Literal(meter),
+        tariff_code=Literal(rate_source["tariff_code"]),
+        cost_type=Literal(cost_type),
+        checksums=checksums,
+    )
+
+    return retrive(psql_config, query)[0][0]
+
+
+def retrive_rollup_costs(
+    psql_config,
+    meters,
+    tariff_code,
+    cost_type,
+    from_date,
+    to_date,
+    table_name=DAILY_COSTS_TABLE,
+):
+    """
+    Return the rolled up daily costs of the meters summed per day, in the same layout as retrive_daily_costs.
+    """
+
+    query = SQL(
+        "select day, sum(rows), sum(consumption), sum(consumption_rounded), sum(consumption_units), avg(calorific_value), sum(cost) from {} \
+            where meter = any({}) and tariff_code = {} and cost_type = {} and day >= {} and day < {} \
+                group by day order by day"
+    ).format(
+        Identifier(table_name),
+        Literal(list(meters)),
+        Literal(tariff_code),
+        Literal(cost_type),
+        Literal(from_date),
+        Literal(to_date),
+    )
+
+    return retrive(psql_config, query)
+
+
+@embeddable
+def query_existing_tables(psql_config, table_names):
+
+    query = SQL(
+        "select name from unnest({}::varchar[]) as name where to_regclass(quote_ident(name)) is not null"
+    ).format(Literal(list(table_names)))
+
+    return {x[0] for x in retrive(psql_config, query)}
+
+
+def query_missing_rate_slices(psql_config, slices, unified=False):
+    """
+    Return the slices whose rates are not stored for the whole of their window, checking them all in one query. Each slice is a dictionary of tariff_code, cost_type, from and to.
+    """
+
+    if not slices:
+        return []
+
+    if unified:
+        stored = query_existing_tables(psql_config, [TARIFF_RATES_TABLE])
+    else:
+        stored = query_existing_tables(
+            psql_config, {s["tariff_code"] + "_" + s["cost_type"] for s in slices}
+        )
+
+    checks = []
+    for index, s in enumerate(slices):
+        if unified:
+            table_name = TARIFF_RATES_TABLE
+            condition = SQL("tariff_code = {} and cost_type = {} and ").format(
+                Literal(s["tariff_code"]), Literal(s["cost_type"])
+            )
+        else:
+            table_name = s["tariff_code"] + "_" + s["cost_type"]
+            condition = SQL("")
+
+        if table_name not in stored:
+            continue
+
+        # a window is covered when the rates overlapping it start before it and either never end or end after it
+        checks.append(
+            SQL(
+                "select {index} from {table} where {condition}valid_from < {to} and (valid_to > {from_} or valid_to is null) \
+                    having min(valid_from) <= {from_} and (bool_or(valid_to is null) or max(valid_to) >= {to})"
+            ).format(
+                index=Literal(index),
+                table=Identifier(table_name),
+                condition=condition,
+                from_=Literal(s["from"]),
+                to=Literal(s["to"]),
+            )
+        )
+
+    covered = set()
+    if checks:
+        covered = {x[0] for x in retrive(psql_config, SQL(" union all ").join(checks))}
+
+    return [s for index, s in enumerate(slices) if index not in covered]
+
+
+def count_consumption(psql_config, consumption_sources, from_date, to_date):
+
+    query = SQL("select count(*) from ({}) c").format(
+        _consumption_query(consumption_sources, from_date, to_date)
+    )
+
+    return retrive(psql_config, query)[0][0]
+
+
+def summarise_consumption(psql_config, consumption_sources, from_date, to_date):
+    """
+    Return the number of rows and the total consumption of the sources between from_date and to_date.
+    """
+
+    query = SQL("select count(*), coalesce(sum(consumption), 0) from ({}) c").format(
+        _consumption_query(consumption_sources, from_date, to_date)
+    )
+
+    count, total = retrive(psql_config, query)[0]
+    return count, float(total)
+
+
 def query_calorific_values(psql_config, table_name, exit_zone, from_date, to_date):
 
     query = SQL(
@@ -478,7 +1634,11 @@ def query_ldz(psql_config, postcode, table_name="LDZ"):
     query = SQL("select ldz from {} where postcode = {} limit 1").format(
         Identifier(table_name), Literal(postcode)
     )
-    result = retrive(psql_config, query)
+    # without a LDZ table the LDZ has to be given to the account
+    try:
+        result = retrive(psql_config, query)
+    except ValueError:
+        return None
     try:
         r = result[0][0]
     except IndexError:
@@ -66,12 +66,12 @@ def add_method_by_product_family(
     if isinstance(family_name, list):
         for dn in family_name:
             tariffs = query_octopus_product_by_family_name(
-                self.psql_config, dn, energy_type, self.GSP
+                self.psql_pool, dn, energy_type, self.GSP
             )
             self.add_method(dn, tariffs, energy_type)
     elif isinstance(family_name, str):
         tariffs = query_octopus_product_by_family_name(
-            self.psql_config, family_name, energy_type, self.GSP
+            self.psql_pool, family_name, energy_type, self.GSP
         )
         self.add_method(family_name, tariffs, energy_type)
     pass
@@ -101,12 +101,12 @@ def add_method_by_product_code(self, product_code: str, energy_type: str | None
     if isinstance(product_code, list):
         for dn in product_code:
             tariffs = query_octopus_product_by_product_code(
-                self.psql_config, dn, energy_type, self.GSP
+                self.psql_pool, dn, energy_type, self.GSP
             )
             self.add_method(dn, tariffs, energy_type)
     elif isinstance(product_code, str):
         tariffs = query_octopus_product_by_product_code(
-            self.psql_config, product_code, energy_type, self.GSP
+            self.psql_pool, product_code, energy_type, self.GSP
         )
         self.add_method(product_code, tariffs, energy_type)
     pass
@@ -281,4 +281,14 @@ def _add_consumption(self):
             for x in consumption_dbs
         ]
 
+        # keys of the meters in the partitioned consumption table
+        data["meters"] = [
+            {
+                "account_id": self.ACCOUNT_ID,
+                "mpan_or_mprn": x["mpan_or_mprn"],
+                "serial_number": x["serial_number"],
+            }
+            for x in consumption_dbs
+        ]
+
         pass
@@ -2,59 +2,63 @@ import csv
 import psycopg
 from psycopg.sql import SQL, Identifier
 
+from ._psql import connect, embeddable, drop_table as _drop_table
+
 
 def drop_table(psql_config, table_name="LDZ"):
 
-    conn = psycopg.connect(**psql_config)
-    curr = conn.cursor()
-    curr.execute(SQL("drop table if exists {}").format(Identifier(table_name)))
-    conn.close()
+    _drop_table(psql_config, table_name)
 
 
-def create_ldz_table(psql_config, table_name="LDZ"):
-    conn = psycopg.connect(**psql_config)
-    curr = conn.cursor()
-    try:
-        curr.execute(
-            SQL(
-                """
-                CREATE TABLE {} (
-                    id serial PRIMARY KEY,
-                    postcode varchar not null,
-                    LDZ varchar not null
-                )"""
-            ).format(Identifier(table_name))
-        )
-
-    except psycopg.errors.DuplicateTable:
-        pass
-
-    conn.close()
+def _ldz_rows():
+    # the postcodes of each gas distribution network with their LDZ
+    for dn in ["NG", "NGN", "SGN", "WWU"]:
 
+        with open(f"./ldz/{dn}.csv", "r") as file:
+            for row in list(csv.reader(file))[1:]:
+                yield [row[0] + row[1], row[2]]
 
-def insert_ldz(psql_config, table_name="LDZ"):
-    conn = psycopg.connect(**psql_config)
-    curr = conn.cursor()
 
-    for dn in ["NG", "NGN", "SGN", "WWU"]:
+@embeddable
+def create_ldz_table(psql_config, table_name="LDZ"):
+    with connect(psql_config) as conn:
+        curr = conn.cursor()
+        try:
+            curr.execute(
+                SQL(
+                    """
+                    CREATE TABLE {} (
+                        id serial PRIMARY KEY,
+                        postcode varchar not null,
+                        LDZ varchar not null
+                    )"""
+                ).format(Identifier(table_name))
+            )
 
-        with open(f"./ldz/{dn}.csv", "r") as file:
-            data = list(csv.reader(file))[1:]
+        except psycopg.errors.DuplicateTable:
+            pass
 
-            with curr.copy(
-                SQL("COPY {} (postcode, LDZ) FROM STDIN").format(Identifier(table_name))
-            ) as copy:
-                for row in data:
-                    post = [row[0] + row[1], row[2]]
-                    try:
-                        copy.write_row(post)
-                    except psycopg.errors.UniqueViolation:
-                        pass
 
-    conn.close()
+@embeddable
+def insert_ldz(psql_config, table_name="LDZ"):
+    with connect(psql_config) as conn:
+        curr = conn.cursor()
+
+        with curr.copy(
+            SQL("COPY {} (postcode, LDZ) FROM STDIN").format(Identifier(table_name))
+        ) as copy:
+            for post in _ldz_rows():
+                try:
+                    copy.write_row(post)
+                except psycopg.errors.UniqueViolation:
+                    pass
 
 
 def setup_ldz_table(config):
+    """
+    Create the LDZ postcode lookup table. config can either be a dictionary of PostgresQL connection settings, a connection pool, e.g. account.psql_pool, or the embedded database of an account created with embedded.
+    """
+
     drop_table(config)
     create_ldz_table(config)
     insert_ldz(config)